@@ -1,42 +1,107 @@
+import os
 import zipfile
 import yaml
 import json
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 INPUT_ZIP = "../data/testslogcomp.zip"
 OUT_PATH = "../data/gold.jsonl"
 
+# member -> [CRC-32, size] of every YAML the current gold.jsonl was built from
+MANIFEST_PATH = "../data/gold_manifest.json"
+
+# libyaml's C loader is several times faster; fall back if PyYAML lacks it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+MAX_WORKERS = os.cpu_count() or 1
+
+
+def parse_member(member, zip_path=INPUT_ZIP):
+    """Gold rows of one YAML test file. Opens the zip itself so it can run in a worker process."""
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        with zf.open(member) as f:
+            data = yaml.load(f, Loader=YAML_LOADER)
+
+    rows = []
+    # Each YAML file is a list of test cases
+    for idx, case in enumerate(data or []):
+        # We only care about cases where the program SHOULD raise an error
+        # ('exception' == True), and we grab the expected error message
+        if case.get("exception"):
+            expected_error = (case.get("output") or "").strip()
+
+            # Build a stable id like "v1.0.yaml::12"
+            test_id = f"{member}::{idx}"
+
+            rows.append({
+                "test_id": test_id,
+                "expected_error": expected_error
+            })
+    return rows
+
+
+def load_previous():
+    """
+    Manifest and rows of the last build, grouped by member. Empty if either
+    file is missing, so the first run parses everything.
+    """
+    if not (os.path.exists(MANIFEST_PATH) and os.path.exists(OUT_PATH)):
+        return {}, {}
+    with open(MANIFEST_PATH, encoding="utf-8") as f:
+        manifest = json.load(f)
+    rows_by_member = defaultdict(list)
+    with open(OUT_PATH, encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            rows_by_member[row["test_id"].rsplit("::", 1)[0]].append(row)
+    return manifest, rows_by_member
+
+
 def main():
-    gold_examples = []
+    t0 = time.time()
+    old_manifest, old_rows = load_previous()
 
     with zipfile.ZipFile(INPUT_ZIP, "r") as zf:
-        for member in zf.namelist():
-            # We only expect YAML test definition files in this zip
-            if not member.lower().endswith(".yaml"):
-                continue
-            with zf.open(member) as f:
-                data = yaml.safe_load(f)
-
-            # Each YAML file is a list of test cases
-            for idx, case in enumerate(data):
-                # We only care about cases where the program SHOULD raise an error
-                # ('exception' == True), and we grab the expected error message
-                if case.get("exception"):
-                    expected_error = (case.get("output") or "").strip()
-
-                    # Build a stable id like "v1.0.yaml::12"
-                    test_id = f"{member}::{idx}"
-
-                    gold_examples.append({
-                        "test_id": test_id,
-                        "expected_error": expected_error
-                    })
-
-    # Write JSONL
-    with open(OUT_PATH, "w", encoding="utf-8") as out_f:
+        # We only expect YAML test definition files in this zip
+        members = [(info.filename, [info.CRC, info.file_size])
+                   for info in zf.infolist()
+                   if info.filename.lower().endswith(".yaml")]
+
+    manifest = dict(members)
+    changed = [m for m, sig in members if old_manifest.get(m) != sig]
+    removed = set(old_manifest) - set(manifest)
+
+    if not changed and not removed:
+        print(f"gold is up to date ({len(members)} files unchanged, "
+              f"{time.time() - t0:.2f}s)")
+        return
+
+    if len(changed) > 1 and MAX_WORKERS > 1:
+        with ProcessPoolExecutor(max_workers=min(MAX_WORKERS, len(changed))) as ex:
+            parsed = dict(zip(changed, ex.map(parse_member, changed)))
+    else:
+        parsed = {m: parse_member(m) for m in changed}
+
+    gold_examples = []
+    for member, _ in members:
+        gold_examples.extend(parsed[member] if member in parsed else old_rows.get(member, []))
+
+    # Write JSONL (and the manifest after it, so it never describes a file
+    # that didn't make it to disk)
+    tmp_path = OUT_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out_f:
         for row in gold_examples:
             out_f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, OUT_PATH)
+    with open(MANIFEST_PATH + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
 
     print(f"wrote {len(gold_examples)} rows to {OUT_PATH}")
+    print(f"re-parsed {len(changed)}/{len(members)} files, dropped {len(removed)} "
+          f"({YAML_LOADER.__name__}, {time.time() - t0:.2f}s)")
 
 if __name__ == "__main__":
     main()
@@ -1,63 +1,150 @@
+import hashlib
 import json
 import random
+import time
 from pathlib import Path
-from prompts import GEN_PROMPT_TEMPLATE, call_ollama
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from prompts import GEN_MULTI_PROMPT_TEMPLATE, POOL, call_ollama
 
 GOLD_PATH = Path("../data/gold.jsonl")
 SYNTH_PATH = Path("../data/synthetic.jsonl")
 
-def main():
-    random.seed(1337)
+SEED = 1337
+
+# Paraphrases asked for in one structured response per gold row. Each gold
+# row yields this many positive pairs and as many negatives. 1 keeps the
+# original dataset (and every benchmark number in the README) as it was;
+# a larger K multiplies the dataset size and with it every judge's runtime.
+PARAPHRASES_PER_ROW = 1
+
+# Generation requests in flight at once, per Ollama server in OLLAMA_HOST
+MAX_WORKERS = 8
+
+
+def row_seed(test_id):
+    """Sampling seed for one gold row: stable across runs, orderings and workers."""
+    digest = hashlib.blake2b(f"{SEED}:{test_id}".encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "big") & 0x7FFFFFFF
+
+
+def variant_id(test_id, k):
+    # First variant keeps the plain id, so K=1 reproduces the old layout
+    return test_id if k == 0 else f"{test_id}~{k + 1}"
+
+
+def paraphrase_schema(k):
+    return {
+        "type": "array",
+        "items": {"type": "string", "minLength": 1},
+        "minItems": k,
+        "maxItems": k,
+    }
+
+
+def parse_paraphrases(raw, k):
+    """Distinct non-empty strings from the model's JSON array, at most k."""
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        data = None
+    if not isinstance(data, list):
+        # Not an array (e.g. cut off at max_tokens): nothing here is safe to
+        # label True, so the row just comes up short
+        return []
 
+    out = []
+    for item in data:
+        if isinstance(item, str) and item.strip() and item.strip() not in out:
+            out.append(item.strip())
+    return out[:k]
+
+
+def generate_paraphrases(ex):
+    gen_prompt = GEN_MULTI_PROMPT_TEMPLATE.format(
+        k=PARAPHRASES_PER_ROW,
+        expected_error=ex["expected_error"],
+    )
+    raw = call_ollama(
+        prompt=gen_prompt,
+        temperature=0.7,    # a bit creative for paraphrasing
+        max_tokens=64 * PARAPHRASES_PER_ROW,
+        format_schema=paraphrase_schema(PARAPHRASES_PER_ROW),
+        seed=row_seed(ex["test_id"]),
+    )
+    return parse_paraphrases(raw, PARAPHRASES_PER_ROW)
+
+
+def main():
     # load gold
     gold_examples = []
     with GOLD_PATH.open(encoding="utf-8") as f:
         for line in f:
             gold_examples.append(json.loads(line))
 
-    synthetic_rows = []
-
-    # 1. Positive pairs (label=True)
-    for ex in gold_examples:
-        gen_prompt = GEN_PROMPT_TEMPLATE.format(
-            expected_error=ex["expected_error"]
-        )
-        student_msg = call_ollama(
-            prompt=gen_prompt,
-            temperature=0.7,    # a bit creative for paraphrasing
-            max_tokens=64
-        ).strip()
-
-        synthetic_rows.append({
-            "test_id": ex["test_id"],
-            "expected_error": ex["expected_error"],
-            "student_error": student_msg,
-            "label": True
-        })
-
-    # 2. Negative pairs (label=False)
-    # We'll shuffle and pair mismatching errors.
-    if len(gold_examples) > 1:
-        shuffled = gold_examples[:]
-        random.shuffle(shuffled)
-
-        for ex, wrong in zip(gold_examples, shuffled):
-            if ex["test_id"] == wrong["test_id"]:
-                continue
-            # We'll just reuse wrong.expected_error as if a student's compiler
-            # said something completely different.
-            synthetic_rows.append({
-                "test_id": ex["test_id"] + "_neg",
-                "expected_error": ex["expected_error"],
-                "student_error": "student compiler: " + wrong["expected_error"],
-                "label": False
-            })
-
-    with SYNTH_PATH.open("w", encoding="utf-8") as f:
-        for row in synthetic_rows:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
-
-    print(f"Wrote {len(synthetic_rows)} pairs to {SYNTH_PATH}")
+    written = 0
+    short_rows = 0
+    failed_rows = 0
+    t0 = time.time()
+
+    with SYNTH_PATH.open("w", encoding="utf-8") as out:
+        # 1. Positive pairs (label=True)
+        # Requests run concurrently; results are taken back in gold order,
+        # so each row is written as soon as everything before it is done.
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS * len(POOL)) as ex_pool:
+            futures = [ex_pool.submit(generate_paraphrases, ex) for ex in gold_examples]
+            for ex, fut in zip(gold_examples, futures):
+                try:
+                    paraphrases = fut.result()
+                except requests.RequestException as e:
+                    # One failed request costs this row its positives, not the run
+                    print(f"{ex['test_id']}: generation failed ({e})")
+                    failed_rows += 1
+                    paraphrases = []
+                if len(paraphrases) < PARAPHRASES_PER_ROW:
+                    short_rows += 1
+                for k, student_msg in enumerate(paraphrases):
+                    out.write(json.dumps({
+                        "test_id": variant_id(ex["test_id"], k),
+                        "expected_error": ex["expected_error"],
+                        "student_error": student_msg,
+                        "label": True
+                    }, ensure_ascii=False) + "\n")
+                    written += 1
+                out.flush()
+
+        gen_secs = time.time() - t0
+
+        # 2. Negative pairs (label=False)
+        # One shuffle per variant; we pair mismatching errors.
+        rng = random.Random(SEED)
+        if len(gold_examples) > 1:
+            for k in range(PARAPHRASES_PER_ROW):
+                shuffled = gold_examples[:]
+                rng.shuffle(shuffled)
+
+                for ex, wrong in zip(gold_examples, shuffled):
+                    if ex["test_id"] == wrong["test_id"]:
+                        continue
+                    # We'll just reuse wrong.expected_error as if a student's compiler
+                    # said something completely different.
+                    out.write(json.dumps({
+                        "test_id": variant_id(ex["test_id"] + "_neg", k),
+                        "expected_error": ex["expected_error"],
+                        "student_error": "student compiler: " + wrong["expected_error"],
+                        "label": False
+                    }, ensure_ascii=False) + "\n")
+                    written += 1
+
+    print(f"Wrote {written} pairs to {SYNTH_PATH}")
+    print(f"Generated {len(gold_examples)} x {PARAPHRASES_PER_ROW} paraphrases in "
+          f"{gen_secs:.1f}s ({len(gold_examples) / max(gen_secs, 1e-9):.1f} requests/sec, "
+          f"{MAX_WORKERS * len(POOL)} in flight)")
+    if short_rows:
+        print(f"Rows with fewer than {PARAPHRASES_PER_ROW} usable paraphrases: {short_rows} "
+              f"({failed_rows} of them failed outright)")
+    POOL.print_stats()
+
 
 if __name__ == "__main__":
     main()
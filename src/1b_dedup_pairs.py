@@ -0,0 +1,24 @@
+import json
+from pathlib import Path
+from dedup import JOBS_PATH, build_jobs, write_jobs, dedup_ratio
+
+SYNTH_PATH = Path("../data/synthetic.jsonl")
+
+def main():
+    rows = []
+    with SYNTH_PATH.open(encoding="utf-8") as f:
+        for line in f:
+            rows.append(json.loads(line))
+
+    jobs = build_jobs(rows)
+    write_jobs(jobs, rows, JOBS_PATH)
+
+    largest = max((len(j["rows"]) for j in jobs), default=0)
+
+    print(f"Wrote {len(jobs)} judge jobs for {len(rows)} pairs to {JOBS_PATH}")
+    print(f"Dedup ratio: {dedup_ratio(jobs, rows):.2f}x "
+          f"({len(rows) - len(jobs)} LLM calls saved)")
+    print(f"Largest group: {largest} pairs")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,25 @@
 import json
 import time
+from collections import Counter
 from pathlib import Path
-from prompts import JUDGE_FEWSHOT_TEMPLATE, call_ollama, normalize_bool
+from prompts import (JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS, call_ollama,
+                     call_ollama_decision)
+from judge_cache import VerdictCache, fewshot_key
+from dedup import load_jobs, dedup_ratio
+from judge_io import JudgmentWriter
+from telemetry import row_fields, print_timing_breakdown
+from judge_service import service_url, remote_verdict
 
 SYNTH_PATH = Path("../data/synthetic.jsonl")
 JUDGE_PATH = Path("../data/judgments.jsonl")
 
+# Keep rows already in JUDGE_PATH and only judge the rest
+RESUME = False
+
+# With JUDGE_SERVICE=host:port set, pairs go to a running judge_service.py
+# (which keeps the model warm and batches them) instead of straight to Ollama
+SERVICE_URL = service_url()
+
 def main():
     # Load pairs
     pairs = []
@@ -13,7 +27,16 @@ def main():
         for line in f:
             pairs.append(json.loads(line))
 
-    judged_rows = []
+    # Identical (canonical) pairs are judged once and fanned back out
+    jobs = load_jobs(pairs)
+    cache = VerdictCache()
+
+    # Each verdict is appended and flushed as soon as it's known
+    writer = JudgmentWriter(JUDGE_PATH, resume=RESUME)
+    todo = writer.pending_jobs(jobs, pairs)
+    latencies = []
+    timings = []
+    stop_reasons = Counter()
 
     # If there's any one-time "model load", measure it here.
     # For an API-style model like call_ollama, there's not really a load step
@@ -28,63 +51,101 @@ def main():
         "You are a health check. Reply with True.\nANSWER:\n"
     )
     t_load_start = time.time()
-    _ = call_ollama(
-        prompt=warmup_prompt,
-        temperature=0.0,
-        max_tokens=4
-    )
+    if not SERVICE_URL:  # the service keeps its model warm itself
+        _ = call_ollama(
+            prompt=warmup_prompt,
+            temperature=0.0,
+            max_tokens=4
+        )
     t_load_end = time.time()
     load_secs = t_load_end - t_load_start
 
     # Now measure actual judging time across all pairs
     t_infer_start = time.time()
-    for row in pairs:
-        prompt = JUDGE_FEWSHOT_TEMPLATE.format(
-            expected_error=row["expected_error"],
-            student_error=row["student_error"]
-        )
+    for row in todo:
+        if SERVICE_URL:
+            t0 = time.time()
+            verdict = remote_verdict(row, SERVICE_URL)
+            verdict["latency_sec"] = time.time() - t0
+            writer.write_job(row, verdict, pairs)
+            latencies.append(verdict["latency_sec"])
+            stop_reasons[verdict["stop_reason"]] += 1
+            continue
+
+        key = fewshot_key(row)
 
         t0 = time.time()
-        raw = call_ollama(
-            prompt=prompt,
-            temperature=0.0,
-            max_tokens=8
-        )
+        hit = cache.get(key)
+        if hit is not None:
+            raw, model_bool = hit["model_output"], hit["model_bool"]
+            stop_reason = "cache"
+            timing = None
+        else:
+            prompt = JUDGE_FEWSHOT_TEMPLATE.format(
+                expected_error=row["expected_error"],
+                student_error=row["student_error"]
+            )
+            # Stop reading as soon as the first token settles True/False
+            result = call_ollama_decision(
+                prompt=prompt,
+                temperature=0.0,
+                max_tokens=JUDGE_MAX_TOKENS
+            )
+            raw, model_bool = result["model_output"], result["model_bool"]
+            stop_reason = result["stop_reason"]
+            timing = result["timing"]
+            timing["queue_sec"] = 0.0  # one call at a time, nothing to wait for
+            timings.append(timing)
+            cache.put(key, raw, model_bool)
         t1 = time.time()
 
-        model_bool = normalize_bool(raw)
-
-        judged_rows.append({
-            **row,
+        writer.write_job(row, {
             "model_output": raw,
             "model_bool": model_bool,
-            "latency_sec": t1 - t0  # per-example latency if you want to keep it
-        })
+            "cached": hit is not None,
+            "stop_reason": stop_reason,
+            "latency_sec": t1 - t0,  # per-example latency if you want to keep it
+            **(row_fields(timing) if timing else {}),
+        }, pairs)
+        latencies.append(t1 - t0)
+        stop_reasons[stop_reason] += 1
     t_infer_end = time.time()
+    writer.close()
 
     infer_secs_total = t_infer_end - t_infer_start
-    avg_ms_per_pair = (infer_secs_total / len(pairs)) * 1000.0
-
-    # Write out judgments.jsonl (same as before)
-    with JUDGE_PATH.open("w", encoding="utf-8") as f:
-        for r in judged_rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    avg_ms_per_pair = (infer_secs_total / max(writer.written, 1)) * 1000.0
 
     # Print timing summary at the end
-    print(f"Wrote {len(judged_rows)} judged pairs to {JUDGE_PATH}")
+    print(f"Wrote {writer.written} judged pairs to {JUDGE_PATH} "
+          f"({writer.skipped} already there)")
     print()
     print("=== TIMING (Qwen judge) ===")
     print(f"Model warmup/load time (s): {load_secs:.3f}")
     print(f"Total inference time (s): {infer_secs_total:.3f}")
     print(f"Avg inference time per pair (ms): {avg_ms_per_pair:.3f}")
+    print(f"Judge jobs after dedup: {len(jobs)} (ratio {dedup_ratio(jobs, pairs):.2f}x)")
+    print(f"Stop reasons: {dict(stop_reasons)}")
 
     # (Optional) also show distribution of per-example latency,
     # since Ollama is sequential
-    latencies = [r["latency_sec"] for r in judged_rows]
-    p50 = sorted(latencies)[len(latencies)//2]
-    p95 = sorted(latencies)[int(len(latencies)*0.95)]
-    print(f"P50 single-call latency (ms): {p50*1000.0:.3f}")
-    print(f"P95 single-call latency (ms): {p95*1000.0:.3f}")
+    if latencies:
+        p50 = sorted(latencies)[len(latencies)//2]
+        p95 = sorted(latencies)[int(len(latencies)*0.95)]
+        print(f"P50 single-call latency (ms): {p50*1000.0:.3f}")
+        print(f"P95 single-call latency (ms): {p95*1000.0:.3f}")
+
+    print()
+    print_timing_breakdown(timings)
+
+    print()
+    cache.print_stats()
+    cache.close()
+
+    return {
+        "load_secs": load_secs,
+        "infer_secs": infer_secs_total,
+        "written": writer.written,
+    }
 
 if __name__ == "__main__":
     main()
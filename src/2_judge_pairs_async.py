@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from prompts import JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS, POOL
+from ollama_async import AsyncOllamaClient
+from hedging import HedgePolicy, hedged
+from judge_cache import VerdictCache, fewshot_key
+from dedup import load_jobs, dedup_ratio
+from judge_io import JudgmentWriter
+from telemetry import row_fields, print_timing_breakdown
+
+SYNTH_PATH = Path("../data/synthetic.jsonl")
+JUDGE_PATH = Path("../data/judgments.jsonl")
+
+# Keep rows already in JUDGE_PATH and only judge the rest
+RESUME = False
+
+# Requests in flight at once (hedge backups aside). Ollama queues whatever
+# exceeds OLLAMA_NUM_PARALLEL, so this can sit well above the old thread
+# count. This semaphore is the only limit: AsyncOllamaClient has none.
+MAX_IN_FLIGHT = 64
+
+# Hedged requests: a call still unanswered at this quantile of recent call
+# latencies gets a backup copy (on another server when OLLAMA_HOST lists
+# several); the first answer wins and the other call is cancelled. At most
+# HEDGE_MAX_RATE of calls are hedged. None (the default) turns hedging off;
+# benchmark.py's "async_hedged" strategy sets 0.95.
+HEDGE_QUANTILE = None
+HEDGE_MAX_RATE = 0.1
+# Let a primary that lost to its backup finish instead of cancelling it, so
+# the report's "primary attempt alone" p99 is exact rather than a lower
+# bound. Costs the server the rest of those calls.
+HEDGE_TRACK_PRIMARY = False
+
+
+def load_pairs():
+    pairs = []
+    with SYNTH_PATH.open(encoding="utf-8") as f:
+        for line in f:
+            pairs.append(json.loads(line))
+    return pairs
+
+
+async def judge_one(client, sem, row, cache, hedge):
+    key = fewshot_key(row)
+
+    t_wait = time.time()
+    async with sem:
+        t0 = time.time()
+        # SQLite blocks; run it off the event loop so the streams keep going
+        hit = await asyncio.to_thread(cache.get, key)
+        if hit is not None:
+            raw, model_bool = hit["model_output"], hit["model_bool"]
+            stop_reason = "cache"
+            timing = None
+        else:
+            prompt = JUDGE_FEWSHOT_TEMPLATE.format(
+                expected_error=row["expected_error"],
+                student_error=row["student_error"],
+            )
+            # Stop reading as soon as the first token settles True/False
+            def call(route=None):
+                return client.generate(
+                    prompt=prompt,
+                    temperature=0.0,
+                    max_tokens=JUDGE_MAX_TOKENS,
+                    decide=True,
+                    route=route,
+                )
+            result = await (hedged(call, hedge) if hedge else call())
+            raw, model_bool = result["model_output"], result["model_bool"]
+            stop_reason = result["stop_reason"]
+            timing = result["timing"]
+            timing["queue_sec"] = t0 - t_wait
+            await asyncio.to_thread(cache.put, key, raw, model_bool)
+        t1 = time.time()
+
+    return {
+        "model_output": raw,
+        "model_bool": model_bool,
+        "cached": hit is not None,
+        "stop_reason": stop_reason,
+        "latency_sec": t1 - t0,
+        **(row_fields(timing) if timing else {}),
+    }
+
+
+async def run(jobs, pairs, cache, writer, hedge):
+    async with AsyncOllamaClient() as client:
+        # Warmup (same as the other judges)
+        warmup_prompt = "You are a health check. Reply with True.\nANSWER:\n"
+        t_load_start = time.time()
+        _ = await client.generate(
+            prompt=warmup_prompt,
+            temperature=0.0,
+            max_tokens=4,
+        )
+        t_load_end = time.time()
+        load_secs = t_load_end - t_load_start
+
+        sem = asyncio.Semaphore(MAX_IN_FLIGHT)
+        t_infer_start = time.time()
+
+        async def judge_and_write(job):
+            # Append each verdict as soon as it's known
+            verdict = await judge_one(client, sem, job, cache, hedge)
+            writer.write_job(job, verdict, pairs)
+            return verdict
+
+        results = await asyncio.gather(*(judge_and_write(job) for job in jobs))
+        t_infer_end = time.time()
+        if hedge:
+            await hedge.settle()
+
+        return results, load_secs, t_infer_end - t_infer_start, client.connections_opened
+
+
+def main():
+    pairs = load_pairs()
+    # Identical (canonical) pairs are judged once and fanned back out
+    jobs = load_jobs(pairs)
+    cache = VerdictCache()
+    writer = JudgmentWriter(JUDGE_PATH, resume=RESUME)
+    todo = writer.pending_jobs(jobs, pairs)
+    hedge = HedgePolicy(quantile=HEDGE_QUANTILE, max_rate=HEDGE_MAX_RATE,
+                        track_primary=HEDGE_TRACK_PRIMARY) if HEDGE_QUANTILE else None
+
+    results, load_secs, infer_secs_total, connections = asyncio.run(
+        run(todo, pairs, cache, writer, hedge)
+    )
+    writer.close()
+    latencies = [v["latency_sec"] for v in results]
+    stop_reasons = Counter(v["stop_reason"] for v in results)
+
+    avg_ms_per_pair = (infer_secs_total / max(writer.written, 1)) * 1000.0
+
+    print(f"Wrote {writer.written} judged pairs to {JUDGE_PATH} "
+          f"({writer.skipped} already there)")
+    print()
+    print("=== TIMING (Qwen judge, asyncio) ===")
+    print(f"Model warmup/load time (s): {load_secs:.3f}")
+    print(f"Total inference time (s): {infer_secs_total:.3f}")
+    print(f"Avg inference time per pair (ms): {avg_ms_per_pair:.3f}")
+    print(f"Judge jobs after dedup: {len(jobs)} (ratio {dedup_ratio(jobs, pairs):.2f}x)")
+    print(f"Stop reasons: {dict(stop_reasons)}")
+    print(f"HTTP connections opened: {connections}")
+
+    if latencies:
+        latencies_sorted = sorted(latencies)
+        p50 = latencies_sorted[len(latencies_sorted) // 2]
+        p95 = latencies_sorted[int(len(latencies_sorted) * 0.95)]
+        p99 = latencies_sorted[int(len(latencies_sorted) * 0.99)]
+        print(f"P50 single-call latency (ms): {p50 * 1000.0:.3f}")
+        print(f"P95 single-call latency (ms): {p95 * 1000.0:.3f}")
+        print(f"P99 single-call latency (ms): {p99 * 1000.0:.3f}")
+    if hedge:
+        print(hedge.summary())
+
+    print()
+    print_timing_breakdown([v for v in results if not v["cached"]])
+
+    print()
+    cache.print_stats()
+    POOL.print_stats()
+    cache.close()
+
+    return {
+        "load_secs": load_secs,
+        "infer_secs": infer_secs_total,
+        "written": writer.written,
+        "hedge_rate": hedge.hedged / max(hedge.requests, 1) if hedge else None,
+    }
+
+
+if __name__ == "__main__":
+    main()
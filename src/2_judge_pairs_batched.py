@@ -1,12 +1,39 @@
+import functools
 import json
+import re
 import time
+from collections import Counter
 from pathlib import Path
-from prompts import BATCH_JUDGE_TEMPLATE, call_ollama, normalize_bool
+from prompts import (BATCH_JUDGE_TEMPLATE, JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS,
+                     DEFAULT_MODEL, call_ollama, call_ollama_decision, normalize_bool)
+from judge_cache import VerdictCache, cache_key, fewshot_key
+from dedup import load_jobs, dedup_ratio
+from judge_io import JudgmentWriter
+from batch_recovery import judge_with_recovery, print_recovery_stats
+from batching import TokenBudgetBatcher, template_tokens
 
 SYNTH_PATH = Path("../data/synthetic.jsonl")
 JUDGE_PATH = Path("../data/judgments.jsonl")
 
-BATCH_SIZE = 16  # tweak this up or down depending on context length / speed
+# Keep rows already in JUDGE_PATH and only judge the rest
+RESUME = False
+
+# Batches are packed by estimated prompt tokens, not a fixed pair count.
+# Tradeoff: bigger budget => fewer calls, but longer prompt. The budget is
+# the whole prompt, template included (~360 tokens, so ~600 go to pairs at
+# the start). It shrinks when the model garbles a batch and grows while it
+# keeps up.
+TOKEN_BUDGET = 960
+ANSWER_TOKENS = 8  # generation tokens per pair
+
+
+def make_batcher():
+    # One per run: the budget adapts, so it mustn't carry over between runs
+    return TokenBudgetBatcher(budget=TOKEN_BUDGET, answer_tokens=ANSWER_TOKENS,
+                              template_tokens=template_tokens(BATCH_JUDGE_TEMPLATE))
+
+
+NUMBERED_ANSWER_RE = re.compile(r"^\s*(?:pair\s*)?(\d+)\s*[:.)\-]\s*(true|false)\b", re.IGNORECASE)
 
 def load_pairs():
     pairs = []
@@ -15,6 +42,10 @@ def load_pairs():
             pairs.append(json.loads(line))
     return pairs
 
+def row_cache_key(row):
+    return cache_key(DEFAULT_MODEL, BATCH_JUDGE_TEMPLATE, 0.0, ANSWER_TOKENS,
+                     row["expected_error"], row["student_error"])
+
 def build_batch_prompt(batch_rows):
     parts = []
     for i, row in enumerate(batch_rows, start=1):
@@ -27,33 +58,62 @@ def build_batch_prompt(batch_rows):
     return BATCH_JUDGE_TEMPLATE.format(pairs_block=pairs_block)
 
 def parse_batch_output(raw, batch_len):
+    """
+    Answers we could parse, as {position: answer} with 0-based positions.
+    Numbered lines ("Pair 3: True", "3. False") are placed by their number,
+    so a partial answer is still usable. Otherwise fall back to positional
+    True/False answers, trusted only when there are enough of them.
+    """
+    answers = {}
+    for ln in raw.splitlines():
+        m = NUMBERED_ANSWER_RE.match(ln)
+        if m and 1 <= int(m.group(1)) <= batch_len:
+            answers.setdefault(int(m.group(1)) - 1, m.group(2))
+    if answers:
+        return answers
+
     # Primary: assume model returns one True/False per line
     lines = [ln.strip() for ln in raw.splitlines() if ln.strip()]
-    answers = []
-
     if len(lines) >= batch_len:
-        answers = lines[:batch_len]
-    else:
-        # Fallback: pull True/False-like tokens from entire text
-        tokens = raw.replace("\n", " ").split()
-        for t in tokens:
-            tl = t.lower()
-            if tl.startswith("true") or tl.startswith("false"):
-                answers.append(t)
-                if len(answers) == batch_len:
-                    break
-
-    if len(answers) != batch_len:
-        raise ValueError(
-            f"Could not parse {batch_len} answers from model output:\n{raw}"
-        )
+        return dict(enumerate(lines[:batch_len]))
+
+    # Fallback: pull True/False-like tokens from entire text
+    tokens = [t for t in raw.split() if t.lower().startswith(("true", "false"))]
+    if len(tokens) >= batch_len:
+        return dict(enumerate(tokens[:batch_len]))
+
+    raise ValueError(
+        f"Could not parse {batch_len} answers from model output:\n{raw}"
+    )
+
+def judge_batch(batch_rows, batcher):
+    prompt = build_batch_prompt(batch_rows)
+    raw = call_ollama(
+        prompt=prompt,
+        temperature=0.0,
+        max_tokens=batcher.max_tokens_for(batch_rows)  # ANSWER_TOKENS per answer plus slack
+    )
+    return parse_batch_output(raw, len(batch_rows))
 
-    return answers
+def judge_single(row):
+    # Last resort for pairs the batch prompt keeps failing on
+    prompt = JUDGE_FEWSHOT_TEMPLATE.format(
+        expected_error=row["expected_error"],
+        student_error=row["student_error"]
+    )
+    return call_ollama_decision(prompt=prompt, temperature=0.0,
+                                max_tokens=JUDGE_MAX_TOKENS)["model_output"]
 
 def main():
     pairs = load_pairs()
 
-    judged_rows = []
+    # Identical (canonical) pairs are judged once and fanned back out
+    jobs = load_jobs(pairs)
+    cache = VerdictCache()
+
+    # Each verdict is appended and flushed as soon as it's known
+    writer = JudgmentWriter(JUDGE_PATH, resume=RESUME)
+    todo = writer.pending_jobs(jobs, pairs)
 
     # Optional warmup call, same as your original script
     warmup_prompt = "You are a health check. Reply with True.\nANSWER:\n"
@@ -69,48 +129,62 @@ def main():
     # Measure batched inference time
     t_infer_start = time.time()
     batch_latencies = []
+    recovery = Counter()
 
-    for i in range(0, len(pairs), BATCH_SIZE):
-        batch = pairs[i : i + BATCH_SIZE]
-        prompt = build_batch_prompt(batch)
-
+    # Cached verdicts are filled in directly; only misses get batched
+    pending = []
+    for row in todo:
         t0 = time.time()
-        raw = call_ollama(
-            prompt=prompt,
-            temperature=0.0,
-            max_tokens=8 * len(batch)  # a few tokens per answer
-        )
+        hit = cache.get(row_cache_key(row))
+        if hit is None:
+            pending.append(row)
+            continue
+        writer.write_job(row, {
+            "model_output": hit["model_output"],
+            "model_bool": hit["model_bool"],
+            "cached": True,
+            "latency_sec": time.time() - t0
+        }, pairs)
+
+    batcher = make_batcher()
+    judge = functools.partial(judge_batch, batcher=batcher)
+    for batch in batcher.batches(pending):
+        t0 = time.time()
+        failures_before = recovery["parse_failures"] + recovery["retries"]
+        # Keeps what parsed, re-submits the rest, bisects down to single pairs
+        via_single = []
+        answers = judge_with_recovery(batch, judge, judge_single, recovery, via_single)
         t1 = time.time()
         batch_latencies.append(t1 - t0)
+        batcher.record(len(batch), t1 - t0,
+                       recovery["parse_failures"] + recovery["retries"] > failures_before)
 
-        answers = parse_batch_output(raw, len(batch))
-
-        for row, ans_raw in zip(batch, answers):
+        for row, ans_raw, single in zip(batch, answers, via_single):
             model_bool = normalize_bool(ans_raw)
-            judged_rows.append({
-                **row,
+            # A fallback verdict came from the few-shot prompt, not this one
+            cache.put(fewshot_key(row) if single else row_cache_key(row), ans_raw, model_bool)
+            writer.write_job(row, {
                 "model_output": ans_raw,
                 "model_bool": model_bool,
+                "cached": False,
                 # Approximate per-example latency inside this batch
                 "latency_sec": (t1 - t0) / len(batch)
-            })
+            }, pairs)
 
     t_infer_end = time.time()
+    writer.close()
     infer_secs_total = t_infer_end - t_infer_start
-    avg_ms_per_pair = (infer_secs_total / len(pairs)) * 1000.0
-
-    # Write out judgments.jsonl with the same schema your eval script expects
-    with JUDGE_PATH.open("w", encoding="utf-8") as f:
-        for r in judged_rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    avg_ms_per_pair = (infer_secs_total / max(writer.written, 1)) * 1000.0
 
     # Timing report (similar to original)
-    print(f"Wrote {len(judged_rows)} judged pairs to {JUDGE_PATH}")
+    print(f"Wrote {writer.written} judged pairs to {JUDGE_PATH} "
+          f"({writer.skipped} already there)")
     print()
     print("=== TIMING (Qwen judge, batched) ===")
     print(f"Model warmup/load time (s): {load_secs:.3f}")
     print(f"Total inference time (s): {infer_secs_total:.3f}")
     print(f"Avg inference time per pair (ms): {avg_ms_per_pair:.3f}")
+    print(f"Judge jobs after dedup: {len(jobs)} (ratio {dedup_ratio(jobs, pairs):.2f}x)")
 
     if batch_latencies:
         sorted_lat = sorted(batch_latencies)
@@ -119,5 +193,21 @@ def main():
         print(f"P50 batch-call latency (ms): {p50*1000.0:.3f}")
         print(f"P95 batch-call latency (ms): {p95*1000.0:.3f}")
 
+    print()
+    print(f"Batches: {len(batch_latencies)} "
+          f"(avg {len(pending) / max(len(batch_latencies), 1):.1f} pairs)")
+    print(batcher.summary())
+    print_recovery_stats(recovery)
+
+    print()
+    cache.print_stats()
+    cache.close()
+
+    return {
+        "load_secs": load_secs,
+        "infer_secs": infer_secs_total,
+        "written": writer.written,
+    }
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,236 @@
+import json
+import random
+import time
+from collections import Counter
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from prompts import (BATCH_JUDGE_JSON_TEMPLATE, JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS,
+                     DEFAULT_MODEL, POOL, call_ollama, call_ollama_decision, normalize_bool)
+from judge_cache import VerdictCache, cache_key, fewshot_key
+from dedup import load_jobs, dedup_ratio
+from judge_io import JudgmentWriter
+from batch_recovery import judge_with_recovery, print_recovery_stats
+from batching import TokenBudgetBatcher, template_tokens
+from batch_json import SCHEMA_ITEM_TOKENS, call_batch_judge, answer_to_raw
+
+SYNTH_PATH = Path("../data/synthetic.jsonl")
+JUDGE_PATH = Path("../data/judgments.jsonl")
+
+# Keep rows already in JUDGE_PATH and only judge the rest
+RESUME = False
+
+# Batches in flight at once, per Ollama server in OLLAMA_HOST. Ollama serves
+# OLLAMA_NUM_PARALLEL requests concurrently (4 by default), so more than
+# that mostly queues server-side.
+BATCH_WORKERS = 4
+
+# Same token-budget packing as 2_judge_pairs_batched_v2.py (whole prompt,
+# template included)
+TOKEN_BUDGET = 1290
+
+# Set to e.g. 96 to time that many uncached pairs, after the run, through
+# sequential batches, hybrid batches and parallel single calls. Off by
+# default: it re-judges the sample three more times.
+COMPARE_SAMPLE = None
+PARALLEL_WORKERS = 8
+
+
+def load_pairs():
+    pairs = []
+    with SYNTH_PATH.open(encoding="utf-8") as f:
+        for line in f:
+            pairs.append(json.loads(line))
+    return pairs
+
+
+def row_cache_key(row):
+    return cache_key(DEFAULT_MODEL, BATCH_JUDGE_JSON_TEMPLATE, 0.0, SCHEMA_ITEM_TOKENS,
+                     row["expected_error"], row["student_error"])
+
+
+def make_batcher():
+    # One per run: the budget adapts, so it mustn't carry over between runs
+    return TokenBudgetBatcher(budget=TOKEN_BUDGET,
+                              template_tokens=template_tokens(BATCH_JUDGE_JSON_TEMPLATE))
+
+
+def judge_single(row):
+    # Last resort for pairs the batch prompt keeps failing on
+    prompt = JUDGE_FEWSHOT_TEMPLATE.format(
+        expected_error=row["expected_error"],
+        student_error=row["student_error"],
+    )
+    return call_ollama_decision(prompt=prompt, temperature=0.0,
+                                max_tokens=JUDGE_MAX_TOKENS)["model_output"]
+
+
+def run_batch(batch):
+    """Worker: one batch through recovery. Stats are per batch, merged by the caller."""
+    stats = Counter()
+    via_single = []
+    t0 = time.time()
+    answers = judge_with_recovery(batch, call_batch_judge, judge_single, stats, via_single)
+    return answers, via_single, time.time() - t0, stats
+
+
+def run_hybrid(rows, batcher, workers, on_batch):
+    """
+    Keep up to `workers` batches in flight. Batches are cut lazily from the
+    batcher, so budget feedback from finished batches shapes the next ones.
+    on_batch(batch, answers, via_single, latency, stats) runs in the calling
+    thread.
+    """
+    batches = batcher.batches(rows)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        in_flight = {}
+        for batch in batches:
+            in_flight[ex.submit(run_batch, batch)] = batch
+            if len(in_flight) >= workers:
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                batch = in_flight.pop(fut)
+                answers, via_single, latency, stats = fut.result()
+                batcher.record(len(batch), latency,
+                               stats["parse_failures"] + stats["retries"] > 0)
+                on_batch(batch, answers, via_single, latency, stats)
+            for batch in batches:
+                in_flight[ex.submit(run_batch, batch)] = batch
+                if len(in_flight) >= workers:
+                    break
+
+
+def compare_modes(rows):
+    """
+    pairs/sec for the same uncached rows under each execution mode. Nothing
+    is cached or written, so every mode pays for real model calls.
+    """
+    rates = {}
+
+    t0 = time.time()
+    seq = make_batcher()
+    for batch in seq.batches(rows):
+        _, _, latency, stats = run_batch(batch)
+        seq.record(len(batch), latency, stats["parse_failures"] + stats["retries"] > 0)
+    rates["batched (sequential)"] = len(rows) / (time.time() - t0)
+
+    t0 = time.time()
+    run_hybrid(rows, make_batcher(),
+               BATCH_WORKERS, lambda *_: None)
+    rates[f"batched x{BATCH_WORKERS} (hybrid)"] = len(rows) / (time.time() - t0)
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=PARALLEL_WORKERS) as ex:
+        list(ex.map(judge_single, rows))
+    rates[f"single x{PARALLEL_WORKERS} (parallel)"] = len(rows) / (time.time() - t0)
+
+    return rates
+
+
+def main():
+    pairs = load_pairs()
+    # Identical (canonical) pairs are judged once and fanned back out
+    jobs = load_jobs(pairs)
+    cache = VerdictCache()
+
+    # Each verdict is appended and flushed as soon as it's known
+    writer = JudgmentWriter(JUDGE_PATH, resume=RESUME)
+    todo = writer.pending_jobs(jobs, pairs)
+
+    warmup_prompt = "You are a health check. Reply with True.\nANSWER:\n"
+    t_load_start = time.time()
+    _ = call_ollama(
+        prompt=warmup_prompt,
+        temperature=0.0,
+        max_tokens=4,
+    )
+    t_load_end = time.time()
+    load_secs = t_load_end - t_load_start
+
+    t_infer_start = time.time()
+    batch_latencies = []
+    recovery = Counter()
+
+    # Cached verdicts are filled in directly; only misses get batched
+    pending = []
+    for row in todo:
+        t0 = time.time()
+        hit = cache.get(row_cache_key(row))
+        if hit is None:
+            pending.append(row)
+            continue
+        writer.write_job(row, {
+            "model_output": hit["model_output"],
+            "model_bool": hit["model_bool"],
+            "cached": True,
+            "latency_sec": time.time() - t0,
+        }, pairs)
+
+    def on_batch(batch, answers, via_single, latency, stats):
+        batch_latencies.append(latency)
+        recovery.update(stats)
+        for row, ans, single in zip(batch, answers, via_single):
+            ans_raw = answer_to_raw(ans)
+            model_bool = normalize_bool(ans_raw)
+            # A fallback verdict came from the few-shot prompt, not this one
+            cache.put(fewshot_key(row) if single else row_cache_key(row), ans_raw, model_bool)
+            writer.write_job(row, {
+                "model_output": ans_raw,
+                "model_bool": model_bool,
+                "cached": False,
+                "latency_sec": latency / len(batch),
+            }, pairs)
+
+    batcher = make_batcher()
+    run_hybrid(pending, batcher, BATCH_WORKERS * len(POOL), on_batch)
+
+    t_infer_end = time.time()
+    writer.close()
+    infer_secs_total = t_infer_end - t_infer_start
+    avg_ms_per_pair = (infer_secs_total / max(writer.written, 1)) * 1000.0
+
+    print(f"Wrote {writer.written} judged pairs to {JUDGE_PATH} "
+          f"({writer.skipped} already there)")
+    print()
+    print("=== TIMING (Qwen judge, batched + parallel) ===")
+    print(f"Model warmup/load time (s): {load_secs:.3f}")
+    print(f"Total inference time (s): {infer_secs_total:.3f}")
+    print(f"Avg inference time per pair (ms): {avg_ms_per_pair:.3f}")
+    print(f"Judge jobs after dedup: {len(jobs)} (ratio {dedup_ratio(jobs, pairs):.2f}x)")
+
+    if batch_latencies:
+        sorted_lat = sorted(batch_latencies)
+        p50 = sorted_lat[len(sorted_lat) // 2]
+        p95 = sorted_lat[int(len(sorted_lat) * 0.95)]
+        print(f"P50 batch-call latency (ms): {p50 * 1000.0:.3f}")
+        print(f"P95 batch-call latency (ms): {p95 * 1000.0:.3f}")
+
+    print()
+    print(f"Batches: {len(batch_latencies)} "
+          f"(avg {len(pending) / max(len(batch_latencies), 1):.1f} pairs, "
+          f"{BATCH_WORKERS * len(POOL)} in flight)")
+    print(batcher.summary())
+    print_recovery_stats(recovery)
+
+    print()
+    cache.print_stats()
+    POOL.print_stats()
+    cache.close()
+
+    if COMPARE_SAMPLE:
+        sample = random.Random(0).sample(todo, min(COMPARE_SAMPLE, len(todo)))
+        print()
+        print(f"=== THROUGHPUT ({len(sample)} uncached pairs) ===")
+        for mode, rate in compare_modes(sample).items():
+            print(f"{mode:<28} {rate:8.2f} pairs/sec")
+
+    return {
+        "load_secs": load_secs,
+        "infer_secs": infer_secs_total,
+        "written": writer.written,
+    }
+
+
+if __name__ == "__main__":
+    main()
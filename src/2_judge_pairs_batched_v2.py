@@ -1,13 +1,35 @@
 import json
 import time
+from collections import Counter
 from pathlib import Path
-from prompts import BATCH_JUDGE_JSON_TEMPLATE, call_ollama, normalize_bool
+from prompts import (BATCH_JUDGE_JSON_TEMPLATE, JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS,
+                     DEFAULT_MODEL, call_ollama, call_ollama_decision, normalize_bool)
+from judge_cache import VerdictCache, cache_key, fewshot_key
+from dedup import load_jobs, dedup_ratio
+from judge_io import JudgmentWriter
+from batch_recovery import judge_with_recovery, print_recovery_stats
+from batching import TokenBudgetBatcher, template_tokens
+from batch_json import SCHEMA_ITEM_TOKENS, call_batch_judge, answer_to_raw
 
 SYNTH_PATH = Path("../data/synthetic.jsonl")
 JUDGE_PATH = Path("../data/judgments.jsonl")
 
-# Tradeoff: bigger batch => faster, but longer prompt
-BATCH_SIZE = 8
+# Keep rows already in JUDGE_PATH and only judge the rest
+RESUME = False
+
+# Batches are packed by estimated prompt tokens, not a fixed pair count.
+# Tradeoff: bigger budget => fewer calls, but longer prompt. The budget is
+# the whole prompt, template included (~690 tokens, so ~600 go to pairs at
+# the start). It shrinks when the model garbles a batch and grows while it
+# keeps up.
+TOKEN_BUDGET = 1290
+
+
+def make_batcher():
+    # One per run: the budget adapts, so it mustn't carry over between runs
+    return TokenBudgetBatcher(budget=TOKEN_BUDGET,
+                              template_tokens=template_tokens(BATCH_JUDGE_JSON_TEMPLATE))
+
 
 def load_pairs():
     pairs = []
@@ -16,70 +38,28 @@ def load_pairs():
             pairs.append(json.loads(line))
     return pairs
 
-def build_pairs_block(batch_rows):
-    """
-    Format as a numbered list that we refer to via `index` in JSON.
-    """
-    parts = []
-    for i, row in enumerate(batch_rows, start=1):
-        parts.append(
-            f"Pair {i}:\n"
-            f"EXPECTED_ERROR:\n{row['expected_error']}\n\n"
-            f"STUDENT_ERROR:\n{row['student_error']}\n"
-        )
-    return "\n".join(parts)
-
-def call_batch_judge(batch_rows):
-    pairs_block = build_pairs_block(batch_rows)
-    # Use .replace instead of .format to avoid brace issues
-    prompt = BATCH_JUDGE_JSON_TEMPLATE.replace("{pairs_block}", pairs_block)
-
-    raw = call_ollama(
-        prompt=prompt,
-        temperature=0.0,
-        # Plenty of room for JSON; still cheap compared to 8 separate calls
-        max_tokens=512,
-    )
-    raw = raw.strip()
-
-    # Defensive: try to isolate JSON array if the model wraps it
-    try:
-        if not raw.lstrip().startswith("["):
-            start = raw.find("[")
-            end = raw.rfind("]")
-            if start != -1 and end != -1 and end > start:
-                raw = raw[start:end + 1]
-
-        data = json.loads(raw)
-    except Exception as e:
-        raise ValueError(f"Failed to parse JSON from model output:\n{raw}\nError: {e}")
-
-
-    if not isinstance(data, list):
-        raise ValueError(f"Model JSON is not a list: {data!r}")
-
-    # Map index -> raw bool-like value
-    answers_by_index = {}
-    for obj in data:
-        if not isinstance(obj, dict):
-            continue
-        idx = obj.get("index")
-        correct = obj.get("correct")
-        if isinstance(idx, int):
-            answers_by_index[idx] = correct
-
-    if len(answers_by_index) != len(batch_rows):
-        raise ValueError(
-            f"Expected {len(batch_rows)} answers, got {len(answers_by_index)}. "
-            f"Model JSON: {data!r}"
-        )
+def row_cache_key(row):
+    return cache_key(DEFAULT_MODEL, BATCH_JUDGE_JSON_TEMPLATE, 0.0, SCHEMA_ITEM_TOKENS,
+                     row["expected_error"], row["student_error"])
 
-    # Return answers in order 1..len(batch_rows)
-    return [answers_by_index[i] for i in range(1, len(batch_rows) + 1)]
+def judge_single(row):
+    # Last resort for pairs the batch prompt keeps failing on
+    prompt = JUDGE_FEWSHOT_TEMPLATE.format(
+        expected_error=row["expected_error"],
+        student_error=row["student_error"],
+    )
+    return call_ollama_decision(prompt=prompt, temperature=0.0,
+                                max_tokens=JUDGE_MAX_TOKENS)["model_output"]
 
 def main():
     pairs = load_pairs()
-    judged_rows = []
+    # Identical (canonical) pairs are judged once and fanned back out
+    jobs = load_jobs(pairs)
+    cache = VerdictCache()
+
+    # Each verdict is appended and flushed as soon as it's known
+    writer = JudgmentWriter(JUDGE_PATH, resume=RESUME)
+    todo = writer.pending_jobs(jobs, pairs)
 
     # Warmup / load time (same as your original script)
     warmup_prompt = "You are a health check. Reply with True.\nANSWER:\n"
@@ -94,46 +74,62 @@ def main():
 
     t_infer_start = time.time()
     batch_latencies = []
+    recovery = Counter()
 
-    for start in range(0, len(pairs), BATCH_SIZE):
-        batch = pairs[start : start + BATCH_SIZE]
-
+    # Cached verdicts are filled in directly; only misses get batched
+    pending = []
+    for row in todo:
+        t0 = time.time()
+        hit = cache.get(row_cache_key(row))
+        if hit is None:
+            pending.append(row)
+            continue
+        writer.write_job(row, {
+            "model_output": hit["model_output"],
+            "model_bool": hit["model_bool"],
+            "cached": True,
+            "latency_sec": time.time() - t0,
+        }, pairs)
+
+    batcher = make_batcher()
+    for batch in batcher.batches(pending):
         t0 = time.time()
-        batch_answers = call_batch_judge(batch)
+        failures_before = recovery["parse_failures"] + recovery["retries"]
+        # Keeps what parsed, re-submits the rest, bisects down to single pairs
+        via_single = []
+        batch_answers = judge_with_recovery(batch, call_batch_judge, judge_single, recovery,
+                                            via_single)
         t1 = time.time()
         batch_latencies.append(t1 - t0)
+        batcher.record(len(batch), t1 - t0,
+                       recovery["parse_failures"] + recovery["retries"] > failures_before)
 
-        for row, ans in zip(batch, batch_answers):
-            # normalize_bool expects a string; we can feed "True"/"False"
-            # but if model gives us a real boolean, handle that too.
-            if isinstance(ans, bool):
-                ans_raw = "True" if ans else "False"
-            else:
-                ans_raw = str(ans)
-
+        for row, ans, single in zip(batch, batch_answers, via_single):
+            ans_raw = answer_to_raw(ans)
             model_bool = normalize_bool(ans_raw)
+            # A fallback verdict came from the few-shot prompt, not this one
+            cache.put(fewshot_key(row) if single else row_cache_key(row), ans_raw, model_bool)
 
-            judged_rows.append({
-                **row,
+            writer.write_job(row, {
                 "model_output": ans_raw,
                 "model_bool": model_bool,
+                "cached": False,
                 "latency_sec": (t1 - t0) / len(batch),
-            })
+            }, pairs)
 
     t_infer_end = time.time()
+    writer.close()
     infer_secs_total = t_infer_end - t_infer_start
-    avg_ms_per_pair = (infer_secs_total / len(judged_rows)) * 1000.0
-
-    with JUDGE_PATH.open("w", encoding="utf-8") as f:
-        for r in judged_rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    avg_ms_per_pair = (infer_secs_total / max(writer.written, 1)) * 1000.0
 
-    print(f"Wrote {len(judged_rows)} judged pairs to {JUDGE_PATH}")
+    print(f"Wrote {writer.written} judged pairs to {JUDGE_PATH} "
+          f"({writer.skipped} already there)")
     print()
     print("=== TIMING (Qwen judge, batched v2) ===")
     print(f"Model warmup/load time (s): {load_secs:.3f}")
     print(f"Total inference time (s): {infer_secs_total:.3f}")
     print(f"Avg inference time per pair (ms): {avg_ms_per_pair:.3f}")
+    print(f"Judge jobs after dedup: {len(jobs)} (ratio {dedup_ratio(jobs, pairs):.2f}x)")
 
     if batch_latencies:
         sorted_lat = sorted(batch_latencies)
@@ -142,5 +138,21 @@ def main():
         print(f"P50 batch-call latency (ms): {p50 * 1000.0:.3f}")
         print(f"P95 batch-call latency (ms): {p95 * 1000.0:.3f}")
 
+    print()
+    print(f"Batches: {len(batch_latencies)} "
+          f"(avg {len(pending) / max(len(batch_latencies), 1):.1f} pairs)")
+    print(batcher.summary())
+    print_recovery_stats(recovery)
+
+    print()
+    cache.print_stats()
+    cache.close()
+
+    return {
+        "load_secs": load_secs,
+        "infer_secs": infer_secs_total,
+        "written": writer.written,
+    }
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,162 @@
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from prompts import INFLIGHT, POOL, call_ollama
+from lexicon import prejudge
+from judge_cache import VerdictCache
+from llm_stage import judge_llm, llm_workers
+from dedup import load_jobs, dedup_ratio
+from judge_io import JudgmentWriter
+from telemetry import row_fields, print_timing_breakdown
+
+SYNTH_PATH = Path("../data/synthetic.jsonl")
+JUDGE_PATH = Path("../data/judgments.jsonl")
+
+# Keep rows already in JUDGE_PATH and only judge the rest
+RESUME = False
+
+
+def load_pairs():
+    pairs = []
+    with SYNTH_PATH.open(encoding="utf-8") as f:
+        for line in f:
+            pairs.append(json.loads(line))
+    return pairs
+
+
+def accuracy(rows, preds):
+    labelled = [(p, r["label"]) for r, p in zip(rows, preds) if "label" in r]
+    if not labelled:
+        return None
+    return sum(p == y for p, y in labelled) / len(labelled)
+
+
+def main():
+    pairs = load_pairs()
+    # Identical (canonical) pairs are judged once and fanned back out
+    jobs = load_jobs(pairs)
+    cache = VerdictCache()
+
+    # ---- timing: warm the LLM (the lexicon is compiled at import)
+    t_load_start = time.time()
+    warmup_prompt = "You are a health check. Reply with True.\nANSWER:\n"
+    _ = call_ollama(
+        prompt=warmup_prompt,
+        temperature=0.0,
+        max_tokens=4,
+    )
+    t_load_end = time.time()
+    load_secs = t_load_end - t_load_start
+
+    # Each verdict is appended and flushed as soon as it's known
+    writer = JudgmentWriter(JUDGE_PATH, resume=RESUME)
+    todo = writer.pending_jobs(jobs, pairs)
+    rules = Counter()
+    timings = []
+    fast_rows, fast_preds = [], []
+    llm_rows, llm_preds = [], []
+
+    # ---- stage 1: lexicon rules, no model involved
+    t_fast_start = time.time()
+    escalated = []
+    for job in todo:
+        verdict, rule = prejudge(job["expected_error"], job["student_error"])
+        rules[rule] += 1
+        if verdict is None:
+            escalated.append((job, rule))
+            continue
+        writer.write_job(job, {
+            "model_output": f"lexicon:{rule}",
+            "model_bool": verdict,
+            "cached": False,
+            "cascade_stage": "lexicon",
+            "lexicon_rule": rule,
+            "latency_sec": 0.0,
+        }, pairs)
+        for i in job["rows"]:
+            fast_rows.append(pairs[i])
+            fast_preds.append(verdict)
+    t_fast_end = time.time()
+    fast_secs = t_fast_end - t_fast_start
+
+    # ---- stage 2: LLM only for what the rules can't settle
+    t_llm_start = time.time()
+    with ThreadPoolExecutor(max_workers=llm_workers()) as ex:
+        futures = {ex.submit(judge_llm, job, cache, time.time()): (job, rule)
+                   for job, rule in escalated}
+        for fut in as_completed(futures):
+            job, rule = futures[fut]
+            raw, model_bool, cached, latency, timing = fut.result()
+            writer.write_job(job, {
+                "model_output": raw,
+                "model_bool": model_bool,
+                "cached": cached,
+                "cascade_stage": "llm",
+                "lexicon_rule": rule,
+                "latency_sec": latency,
+                **(row_fields(timing) if timing else {}),
+            }, pairs)
+            for i in job["rows"]:
+                llm_rows.append(pairs[i])
+                llm_preds.append(model_bool)
+            if timing:
+                timings.append(timing)
+    t_llm_end = time.time()
+    llm_secs = t_llm_end - t_llm_start
+    writer.close()
+
+    infer_secs_total = fast_secs + llm_secs
+    avg_ms_per_pair = (infer_secs_total / max(writer.written, 1)) * 1000.0
+    fast_jobs = len(todo) - len(escalated)
+    fast_acc = accuracy(fast_rows, fast_preds)
+    llm_acc = accuracy(llm_rows, llm_preds)
+
+    print(f"Wrote {writer.written} judged pairs to {JUDGE_PATH} "
+          f"({writer.skipped} already there)")
+    print()
+    print("=== LEXICON FAST PATH (rules -> Qwen judge) ===")
+    print(f"Decided by lexicon: {fast_jobs} of {len(todo)} jobs "
+          f"({fast_jobs / max(len(todo), 1):.1%}), {len(fast_rows)} rows"
+          + (f", accuracy {fast_acc:.3f}" if fast_acc is not None else ""))
+    print(f"Sent to LLM: {len(escalated)} jobs, {len(llm_rows)} rows"
+          + (f", accuracy {llm_acc:.3f}" if llm_acc is not None else ""))
+    print(f"Rules: {dict(rules.most_common())}")
+    print(f"Judge jobs after dedup: {len(jobs)} (ratio {dedup_ratio(jobs, pairs):.2f}x)")
+    print()
+    print("=== TIMING ===")
+    print(f"Model warmup/load time (s): {load_secs:.3f}")
+    print(f"Lexicon stage time (ms): {fast_secs * 1000.0:.3f}")
+    print(f"LLM stage time (s): {llm_secs:.3f}")
+    print(f"Total inference time (s): {infer_secs_total:.3f}")
+    print(f"Avg inference time per pair (ms): {avg_ms_per_pair:.3f}")
+
+    # Not measured: every job through the LLM, assuming each costs what the
+    # escalated ones cost here. Benchmark "lexicon" against "parallel" for a
+    # measured comparison.
+    if escalated:
+        est_llm_only_secs = llm_secs / len(escalated) * len(todo)
+        print(f"Estimated LLM-only time (s, extrapolated): {est_llm_only_secs:.3f}")
+        print(f"Estimated speedup vs LLM-only (extrapolated): "
+              f"{est_llm_only_secs / infer_secs_total:.2f}x")
+
+    print()
+    print_timing_breakdown(timings)
+
+    print()
+    cache.print_stats()
+    cache.close()
+    INFLIGHT.print_stats()
+    POOL.print_stats()
+
+    return {
+        "load_secs": load_secs,
+        "infer_secs": infer_secs_total,
+        "written": writer.written,
+        "fast_path_rate": fast_jobs / max(len(todo), 1),
+    }
+
+
+if __name__ == "__main__":
+    main()
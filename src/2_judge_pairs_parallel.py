@@ -1,14 +1,39 @@
 import json
 import time
+import requests
+from collections import Counter
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from prompts import JUDGE_FEWSHOT_TEMPLATE, call_ollama, normalize_bool
+from prompts import (JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS, INFLIGHT, POOL,
+                     call_ollama, call_ollama_decision)
+from judge_cache import VerdictCache, fewshot_key
+from dedup import load_jobs, dedup_ratio
+from judge_io import JudgmentWriter
+from concurrency import AIMDLimiter
+from telemetry import row_fields, print_timing_breakdown
+from judge_service import service_url, remote_verdict
 
 SYNTH_PATH = Path("../data/synthetic.jsonl")
 JUDGE_PATH = Path("../data/judgments.jsonl")
 
-# You can tune this (8, 12, 16, ...)
-MAX_WORKERS = 16
+# Keep rows already in JUDGE_PATH and only judge the rest
+RESUME = False
+
+# With JUDGE_SERVICE=host:port set, pairs go to a running judge_service.py
+# (which keeps the model warm and batches them) instead of straight to Ollama
+SERVICE_URL = service_url()
+
+# Upper bound on worker threads. How many of them talk to Ollama at once is
+# decided at runtime by the AIMD limiter, starting from INITIAL_CONCURRENCY
+# per Ollama server in OLLAMA_HOST.
+MAX_WORKERS = 64
+INITIAL_CONCURRENCY = 4
+
+# A pair whose call fails (connection error, HTTP error) is retried this
+# many times, pausing a little longer each time. If it still fails it is
+# left out of JUDGE_PATH, so a rerun with RESUME = True picks it up.
+JUDGE_RETRIES = 2
+RETRY_PAUSE_SECS = 1.0
 
 
 def load_pairs():
@@ -19,69 +44,123 @@ def load_pairs():
     return pairs
 
 
-def judge_one(row):
-    prompt = JUDGE_FEWSHOT_TEMPLATE.format(
-        expected_error=row["expected_error"],
-        student_error=row["student_error"],
-    )
+def judge_one(row, cache, limiter, t_submit):
+    if SERVICE_URL:
+        t0 = time.time()
+        verdict = remote_verdict(row, SERVICE_URL)
+        return {**verdict, "latency_sec": time.time() - t0}
+
+    key = fewshot_key(row)
 
     t0 = time.time()
-    raw = call_ollama(
-        prompt=prompt,
-        temperature=0.0,
-        max_tokens=8,
-    )
+    hit = cache.get(key)
+    if hit is not None:
+        raw, model_bool = hit["model_output"], hit["model_bool"]
+        stop_reason = "cache"
+        timing = None
+    else:
+        prompt = JUDGE_FEWSHOT_TEMPLATE.format(
+            expected_error=row["expected_error"],
+            student_error=row["student_error"],
+        )
+        for attempt in range(JUDGE_RETRIES + 1):
+            try:
+                # A failure leaves the slot with ok=False, so the limiter backs off
+                with limiter.slot():
+                    t0 = time.time()  # don't count time spent waiting for a slot
+                    queue_sec = t0 - t_submit  # thread pool + limiter wait (+ retries)
+                    # Stop reading as soon as the first token settles True/False
+                    result = call_ollama_decision(
+                        prompt=prompt,
+                        temperature=0.0,
+                        max_tokens=JUDGE_MAX_TOKENS,
+                    )
+                break
+            except requests.RequestException:
+                if attempt == JUDGE_RETRIES:
+                    raise
+                time.sleep(RETRY_PAUSE_SECS * (attempt + 1))
+        raw, model_bool = result["model_output"], result["model_bool"]
+        stop_reason = result["stop_reason"]
+        timing = result["timing"]
+        timing["queue_sec"] = queue_sec
+        cache.put(key, raw, model_bool)
     t1 = time.time()
 
-    model_bool = normalize_bool(raw)
-
     return {
-        **row,
         "model_output": raw,
         "model_bool": model_bool,
+        "cached": hit is not None,
+        "stop_reason": stop_reason,
         "latency_sec": t1 - t0,
+        **(row_fields(timing) if timing else {}),
     }
 
 
 def main():
     pairs = load_pairs()
-    judged_rows = []
-
-    # Warmup (same as original)
+    # Identical (canonical) pairs are judged once and fanned back out
+    jobs = load_jobs(pairs)
+    cache = VerdictCache()
+    limiter = AIMDLimiter(initial=INITIAL_CONCURRENCY * len(POOL), min_limit=len(POOL),
+                          max_limit=MAX_WORKERS)
+
+    # Each verdict is appended and flushed as soon as it's known
+    writer = JudgmentWriter(JUDGE_PATH, resume=RESUME)
+    todo = writer.pending_jobs(jobs, pairs)
+    latencies = []
+    timings = []
+    stop_reasons = Counter()
+    failed = 0
+
+    # Warmup (same as original); the service keeps its model warm itself
     warmup_prompt = "You are a health check. Reply with True.\nANSWER:\n"
     t_load_start = time.time()
-    _ = call_ollama(
-        prompt=warmup_prompt,
-        temperature=0.0,
-        max_tokens=4,
-    )
+    if not SERVICE_URL:
+        _ = call_ollama(
+            prompt=warmup_prompt,
+            temperature=0.0,
+            max_tokens=4,
+        )
     t_load_end = time.time()
     load_secs = t_load_end - t_load_start
 
     # Parallel inference
     t_infer_start = time.time()
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        futures = [ex.submit(judge_one, row) for row in pairs]
+        futures = {ex.submit(judge_one, job, cache, limiter, time.time()): job for job in todo}
         for fut in as_completed(futures):
-            judged_rows.append(fut.result())
+            try:
+                verdict = fut.result()
+            except requests.RequestException as e:
+                failed += 1
+                print(f"Gave up on a pair after {JUDGE_RETRIES + 1} attempts: {e}")
+                continue
+            writer.write_job(futures[fut], verdict, pairs)
+            latencies.append(verdict["latency_sec"])
+            if not verdict["cached"]:
+                timings.append(verdict)
+            stop_reasons[verdict["stop_reason"]] += 1
     t_infer_end = time.time()
+    writer.close()
 
     infer_secs_total = t_infer_end - t_infer_start
-    avg_ms_per_pair = (infer_secs_total / len(judged_rows)) * 1000.0
-
-    # Write results
-    with JUDGE_PATH.open("w", encoding="utf-8") as f:
-        for r in judged_rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    avg_ms_per_pair = (infer_secs_total / max(writer.written, 1)) * 1000.0
 
-    print(f"Wrote {len(judged_rows)} judged pairs to {JUDGE_PATH}")
+    print(f"Wrote {writer.written} judged pairs to {JUDGE_PATH} "
+          f"({writer.skipped} already there)")
+    if failed:
+        print(f"{failed} jobs failed and were not written; rerun with RESUME = True")
     print()
     print("=== TIMING (Qwen judge, parallel) ===")
     print(f"Model warmup/load time (s): {load_secs:.3f}")
     print(f"Total inference time (s): {infer_secs_total:.3f}")
     print(f"Avg inference time per pair (ms): {avg_ms_per_pair:.3f}")
+    print(f"Judge jobs after dedup: {len(jobs)} (ratio {dedup_ratio(jobs, pairs):.2f}x)")
+    print(f"Stop reasons: {dict(stop_reasons)}")
+    print(f"Adaptive concurrency settled at: {limiter.settled_limit()} "
+          f"(path: {' -> '.join(str(n) for n in limiter.history)})")
 
-    latencies = [r["latency_sec"] for r in judged_rows]
     if latencies:
         latencies_sorted = sorted(latencies)
         p50 = latencies_sorted[len(latencies_sorted) // 2]
@@ -89,6 +168,21 @@ def main():
         print(f"P50 single-call latency (ms): {p50 * 1000.0:.3f}")
         print(f"P95 single-call latency (ms): {p95 * 1000.0:.3f}")
 
+    print()
+    print_timing_breakdown(timings)
+
+    print()
+    cache.print_stats()
+    cache.close()
+    INFLIGHT.print_stats()
+    POOL.print_stats()
+
+    return {
+        "load_secs": load_secs,
+        "infer_secs": infer_secs_total,
+        "written": writer.written,
+    }
+
 
 if __name__ == "__main__":
     main()
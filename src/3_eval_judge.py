@@ -1,52 +1,95 @@
-import json
+import argparse
 from pathlib import Path
-from collections import Counter
+import numpy as np
+from evaluation import evaluate_file, metrics_from_counts, compare_files
 
 JUDGE_PATH = Path("../data/judgments.jsonl")
 
-def main():
-    rows = []
-    with JUDGE_PATH.open(encoding="utf-8") as f:
-        for line in f:
-            rows.append(json.loads(line))
-
-    total = len(rows)
-    correct = sum(1 for r in rows if r["model_bool"] == r["label"])
-    acc = correct / total if total else 0.0
-
-    # Confusion matrix
-    # TP = predicted True and label True
-    # FP = predicted True and label False
-    # TN = predicted False and label False
-    # FN = predicted False and label True
-    confusion = Counter()
-    for r in rows:
-        confusion[(r["label"], r["model_bool"])] += 1
-
-    TP = confusion[(True, True)]
-    FP = confusion[(False, True)]
-    TN = confusion[(False, False)]
-    FN = confusion[(True, False)]
-
-    # Metrics
-    precision_true = TP / (TP + FP) if (TP + FP) > 0 else 0.0
-    recall_true = TP / (TP + FN) if (TP + FN) > 0 else 0.0
-    f1_true = (
-        2 * precision_true * recall_true / (precision_true + recall_true)
-        if (precision_true + recall_true) > 0 else 0.0
-    )
-
-    precision_false = TN / (TN + FN) if (TN + FN) > 0 else 0.0
-    recall_false = TN / (TN + FP) if (TN + FP) > 0 else 0.0
-    f1_false = (
-        2 * precision_false * recall_false / (precision_false + recall_false)
-        if (precision_false + recall_false) > 0 else 0.0
-    )
+# Wrong cases printed at the end: a uniform random sample of this many
+MAX_ERRORS_SHOWN = 20
+
+# Bootstrap replicates for the confidence intervals (0 to skip them)
+BOOTSTRAP_SAMPLES = 2000
+
+# Flipped verdicts printed by --compare: a uniform random sample of this many
+MAX_FLIPS_SHOWN = 20
+
+METRICS = ["accuracy", "precision_true", "recall_true", "f1_true",
+           "precision_false", "recall_false", "f1_false"]
+
+def fmt(ev, key):
+    value = ev["metrics"][key]
+    if key not in ev["ci"]:
+        return f"{value:.3f}"
+    lo, hi = ev["ci"][key]
+    return f"{value:.3f}  (95% CI {lo:.3f}-{hi:.3f})"
+
+def compare(baseline, judge_path):
+    d = compare_files(baseline, judge_path, flip_sample=MAX_FLIPS_SHOWN,
+                      bootstrap=BOOTSTRAP_SAMPLES)
+    print("=== RUN COMPARISON ===")
+    print(f"A (baseline): {baseline}  ({d['pairs_a']} pairs)")
+    print(f"B           : {judge_path}  ({d['pairs_b']} pairs)")
+    print(f"Joined on test_id: {d['joined']}")
+    if d["label_changed"]:
+        print(f"Gold label differs between files for {d['label_changed']} pairs (A's label used)")
+
+    print(f"\n{'metric':<16} {'A':>7} {'B':>7} {'B - A':>8}   95% CI")
+    for key in METRICS:
+        a, b = d["metrics_a"][key], d["metrics_b"][key]
+        ci = d["delta_ci"].get(key)
+        ci_txt = f"{ci[0]:+.3f} to {ci[1]:+.3f}" if ci else ""
+        print(f"{key:<16} {a:>7.3f} {b:>7.3f} {b - a:>+8.3f}   {ci_txt}")
+
+    print(f"\nFlipped verdicts: {d['flipped']}")
+    print(f"  fixed by B (A wrong, B right): {d['only_b_right']}")
+    print(f"  broken by B (A right, B wrong): {d['only_a_right']}")
+    print(f"McNemar p-value: {d['mcnemar_p']:.4f}"
+          f"{'  (significant at 0.05)' if d['mcnemar_p'] < 0.05 else ''}")
+
+    lat = d["latency_delta"]
+    if len(lat):
+        print(f"\nLatency B - A over {len(lat)} pairs with a model call in both runs:")
+        print(f"  mean {lat.mean() * 1000:+.1f} ms, median {np.median(lat) * 1000:+.1f} ms, "
+              f"p5 {np.quantile(lat, 0.05) * 1000:+.1f} ms, p95 {np.quantile(lat, 0.95) * 1000:+.1f} ms")
+        print(f"  B faster on {np.count_nonzero(lat < 0) / len(lat):.0%} of pairs")
+
+    shown = len(d["flips"])
+    print(f"\nFlipped cases ({shown} of {d['flipped']}"
+          f"{', random sample' if shown < d['flipped'] else ''}):\n")
+    for ra, rb in d["flips"]:
+        print("test_id        :", ra["test_id"])
+        print("expected_error :", ra["expected_error"])
+        print("student_error  :", ra["student_error"])
+        print("gold label     :", ra["label"])
+        print("A model_output :", ra["model_output"])
+        print("B model_output :", rb["model_output"])
+        print("---")
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Evaluate a judgments file, or diff it against another run.")
+    p.add_argument("--judgments", default=str(JUDGE_PATH))
+    p.add_argument("--compare", metavar="BASELINE",
+                   help="judgments file of a previous run: report flips and metric deltas instead")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(args.compare, args.judgments)
+        return
+
+    ev = evaluate_file(args.judgments, error_sample=MAX_ERRORS_SHOWN, bootstrap=BOOTSTRAP_SAMPLES)
+    c = ev["counts"]
+    confusion = {(True, True): c["tp"], (False, True): c["fp"],
+                 (False, False): c["tn"], (True, False): c["fn"]}
 
     # Report
     print("=== MODEL EVALUATION ===")
-    print(f"Total pairs: {total}")
-    print(f"Accuracy: {acc:.3f}\n")
+    print(f"Total pairs: {ev['total']}")
+    if ev["bad_lines"]:
+        print(f"Unreadable lines skipped: {ev['bad_lines']}")
+    print(f"Accuracy: {fmt(ev, 'accuracy')}\n")
 
     print("Confusion matrix (gold -> model):")
     for gold in [True, False]:
@@ -54,24 +97,32 @@ def main():
             print(f"  gold={gold:5} pred={pred:5}: {confusion[(gold, pred)]}")
 
     print("\n--- Metrics for predicting True ---")
-    print(f"Precision: {precision_true:.3f}")
-    print(f"Recall:    {recall_true:.3f}")
-    print(f"F1-score:  {f1_true:.3f}")
+    print(f"Precision: {fmt(ev, 'precision_true')}")
+    print(f"Recall:    {fmt(ev, 'recall_true')}")
+    print(f"F1-score:  {fmt(ev, 'f1_true')}")
 
     print("\n--- Metrics for predicting False ---")
-    print(f"Precision: {precision_false:.3f}")
-    print(f"Recall:    {recall_false:.3f}")
-    print(f"F1-score:  {f1_false:.3f}")
-
-    print("\nWrong cases:\n")
-    for r in rows:
-        if r["model_bool"] != r["label"]:
-            print("test_id        :", r["test_id"])
-            print("expected_error :", r["expected_error"])
-            print("student_error  :", r["student_error"])
-            print("gold label     :", r["label"])
-            print("model_output   :", r["model_output"])
-            print("---")
+    print(f"Precision: {fmt(ev, 'precision_false')}")
+    print(f"Recall:    {fmt(ev, 'recall_false')}")
+    print(f"F1-score:  {fmt(ev, 'f1_false')}")
+
+    print("\n--- Per test file ---")
+    print(f"{'file':<24} {'pairs':>7} {'accuracy':>9} {'f1_true':>8} {'f1_false':>9}")
+    for name, counts in sorted(ev["per_file"].items()):
+        m = metrics_from_counts(counts)
+        print(f"{name:<24} {int(counts.sum()):>7} {m['accuracy']:>9.3f} "
+              f"{m['f1_true']:>8.3f} {m['f1_false']:>9.3f}")
+
+    shown = len(ev["errors"])
+    print(f"\nWrong cases ({shown} of {ev['n_errors']}"
+          f"{', random sample' if shown < ev['n_errors'] else ''}):\n")
+    for r in ev["errors"]:
+        print("test_id        :", r["test_id"])
+        print("expected_error :", r["expected_error"])
+        print("student_error  :", r["student_error"])
+        print("gold label     :", r["label"])
+        print("model_output   :", r["model_output"])
+        print("---")
 
 if __name__ == "__main__":
     main()
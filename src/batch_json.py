@@ -0,0 +1,128 @@
+import json
+import re
+from prompts import BATCH_JUDGE_JSON_TEMPLATE, call_ollama
+
+JSON_OBJECT_RE = re.compile(r"\{[^{}]*\}")
+
+# Generated tokens per {"index": N, "correct": bool} element, separators and
+# the whitespace the grammar allows included
+SCHEMA_ITEM_TOKENS = 14
+
+
+def batch_schema(batch_len):
+    """
+    JSON schema for exactly `batch_len` answers, the i-th one with index i.
+    Passed as Ollama's `format`, it turns into a decoding grammar, so the
+    model can't skip, repeat or reorder pairs, or add text around the array.
+
+    No `items` key: llama.cpp's converter reads `items` in preference to
+    `prefixItems`, so "items": false would leave a grammar with no elements.
+    The prefixItems tuple alone already fixes the length.
+    """
+    return {
+        "type": "array",
+        "prefixItems": [
+            {
+                "type": "object",
+                "properties": {
+                    "index": {"const": i},
+                    "correct": {"type": "boolean"},
+                },
+                "required": ["index", "correct"],
+                "additionalProperties": False,
+            }
+            for i in range(1, batch_len + 1)
+        ],
+        "minItems": batch_len,
+        "maxItems": batch_len,
+    }
+
+
+def schema_max_tokens(batch_len):
+    # The grammar ends generation when the array closes; this is only a cap
+    return SCHEMA_ITEM_TOKENS * batch_len + 4
+
+
+def build_pairs_block(batch_rows):
+    """
+    Format as a numbered list that we refer to via `index` in JSON.
+    """
+    parts = []
+    for i, row in enumerate(batch_rows, start=1):
+        parts.append(
+            f"Pair {i}:\n"
+            f"EXPECTED_ERROR:\n{row['expected_error']}\n\n"
+            f"STUDENT_ERROR:\n{row['student_error']}\n"
+        )
+    return "\n".join(parts)
+
+
+def call_batch_judge(batch_rows):
+    pairs_block = build_pairs_block(batch_rows)
+    # Use .replace instead of .format to avoid brace issues
+    prompt = BATCH_JUDGE_JSON_TEMPLATE.replace("{pairs_block}", pairs_block)
+
+    raw = call_ollama(
+        prompt=prompt,
+        temperature=0.0,
+        max_tokens=schema_max_tokens(len(batch_rows)),
+        format_schema=batch_schema(len(batch_rows)),
+    )
+    raw = raw.strip()
+
+    return parse_batch_json(raw, len(batch_rows))
+
+
+def parse_batch_json(raw, batch_len):
+    """
+    {position: answer} (0-based) for every well-formed {index, correct}
+    object in the model output. Missing or malformed entries are simply
+    absent, so the caller can re-submit just those pairs.
+
+    With the schema constraint the output is a well-formed array; the
+    salvage paths below only matter if generation hits the token cap or the
+    server ignores `format`.
+    """
+    # Defensive: try to isolate JSON array if the model wraps it
+    if not raw.lstrip().startswith("["):
+        start = raw.find("[")
+        end = raw.rfind("]")
+        if start != -1 and end != -1 and end > start:
+            raw = raw[start:end + 1]
+
+    try:
+        data = json.loads(raw)
+        if not isinstance(data, list):
+            data = []
+    except ValueError:
+        # Truncated or broken array: salvage the objects that are complete
+        data = []
+        for obj in JSON_OBJECT_RE.findall(raw):
+            try:
+                data.append(json.loads(obj))
+            except ValueError:
+                continue
+
+    # Map index -> raw bool-like value
+    answers_by_index = {}
+    for obj in data:
+        if not isinstance(obj, dict):
+            continue
+        idx = obj.get("index")
+        correct = obj.get("correct")
+        if isinstance(correct, str) and correct.strip().lower() in ("true", "false"):
+            correct = correct.strip().lower() == "true"
+        if isinstance(idx, int) and 1 <= idx <= batch_len and isinstance(correct, bool):
+            answers_by_index.setdefault(idx - 1, correct)
+
+    if not answers_by_index:
+        raise ValueError(f"No usable answers in model output:\n{raw}")
+    return answers_by_index
+
+
+def answer_to_raw(ans):
+    # normalize_bool expects a string; we can feed "True"/"False"
+    # but if model gives us a real boolean, handle that too.
+    if isinstance(ans, bool):
+        return "True" if ans else "False"
+    return str(ans)
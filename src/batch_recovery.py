@@ -0,0 +1,94 @@
+import time
+from collections import Counter
+import requests
+
+# A single-pair fallback that hits an HTTP error is retried this many times,
+# pausing a little longer each time, before the error ends the run
+SINGLE_RETRIES = 2
+RETRY_PAUSE_SECS = 1.0
+
+
+def judge_with_recovery(batch, judge_batch, judge_single, stats=None, via_single=None):
+    """
+    Judge `batch` without letting one bad model response abort the run.
+
+    judge_batch(rows) returns {position: answer} for whatever it could parse
+    (positions are 0-based within `rows`) and may raise ValueError when
+    nothing is usable. judge_single(row) judges one pair on its own. An HTTP
+    error on a batch is handled like an unusable answer; on a single pair
+    it is retried SINGLE_RETRIES times.
+
+    Answers that parsed are kept. If some are missing, only those rows are
+    re-submitted as a smaller batch. If a batch yields nothing at all, it is
+    split in halves, down to single-pair calls. Returns answers in batch
+    order; `stats` (a Counter) collects batch_calls, parse_failures,
+    request_errors, retries, splits and fallbacks. `via_single`, if given
+    (a list), gets one bool per row in batch order: True where the answer
+    came from judge_single, whose verdicts belong under a different cache
+    key than the batch prompt's.
+    """
+    if stats is None:
+        stats = Counter()
+    results = _recover(batch, judge_batch, judge_single, stats)
+    if via_single is not None:
+        via_single.extend(single for _, single in results)
+    return [ans for ans, _ in results]
+
+
+def _recover(batch, judge_batch, judge_single, stats):
+    # (answer, from judge_single) per row
+    if len(batch) == 1:
+        stats["fallbacks"] += 1
+        return [(_judge_single(batch[0], judge_single, stats), True)]
+
+    stats["batch_calls"] += 1
+    try:
+        got = judge_batch(batch)
+    except ValueError:
+        stats["parse_failures"] += 1
+        got = {}
+    except requests.RequestException:
+        stats["request_errors"] += 1
+        got = {}
+
+    answers = [(got.get(i), False) for i in range(len(batch))]
+    missing = [i for i in range(len(batch)) if i not in got]
+    if not missing:
+        return answers
+
+    sub = [batch[i] for i in missing]
+    if len(missing) < len(batch):
+        # Partial success: re-submit just the rows that didn't come back
+        stats["retries"] += 1
+        sub_answers = _recover(sub, judge_batch, judge_single, stats)
+    else:
+        # Nothing usable: bisect
+        stats["splits"] += 1
+        mid = len(sub) // 2
+        sub_answers = (
+            _recover(sub[:mid], judge_batch, judge_single, stats)
+            + _recover(sub[mid:], judge_batch, judge_single, stats)
+        )
+
+    for i, ans in zip(missing, sub_answers):
+        answers[i] = ans
+    return answers
+
+
+def _judge_single(row, judge_single, stats):
+    for attempt in range(SINGLE_RETRIES + 1):
+        try:
+            return judge_single(row)
+        except requests.RequestException:
+            stats["request_errors"] += 1
+            if attempt == SINGLE_RETRIES:
+                raise
+            time.sleep(RETRY_PAUSE_SECS * (attempt + 1))
+
+
+def print_recovery_stats(stats):
+    print(f"Batch calls: {stats['batch_calls']} "
+          f"(parse failures {stats['parse_failures']}, "
+          f"request errors {stats['request_errors']}, "
+          f"retries {stats['retries']}, splits {stats['splits']})")
+    print(f"Single-pair fallbacks: {stats['fallbacks']}")
@@ -0,0 +1,99 @@
+from collections import deque
+
+# Rough chars-per-token for English error messages on Qwen-style BPE vocabularies
+CHARS_PER_TOKEN = 3.5
+
+
+def estimate_tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def template_tokens(template):
+    """Estimated tokens of a batch prompt template without its pairs."""
+    return estimate_tokens(template.replace("{pairs_block}", ""))
+
+
+class TokenBudgetBatcher:
+    """
+    Packs pairs into batches by estimated prompt tokens instead of a fixed count.
+
+    Budgets are whole-prompt sizes: the fixed instructions of the template
+    (`template_tokens`, counted once per batch) plus the pairs. Each pair
+    costs its estimated tokens plus `pair_overhead` (the "Pair N:" /
+    EXPECTED_ERROR / STUDENT_ERROR scaffolding). A batch closes when adding
+    the next pair would exceed `budget`, or when it hits `max_pairs`.
+    `min_budget` and `max_budget` default to the template plus 120 and 2400
+    tokens of pairs.
+
+    The budget adapts after every batch via `record()`, from the failure
+    rate over the last `window` batches. Above `max_failure_rate` (the model
+    losing track of a long list) it shrinks multiplicatively. Otherwise, if
+    per-pair latency is no worse than the best seen, it grows by
+    `grow_step` tokens, up to `max_budget`.
+    """
+
+    def __init__(self, budget=600, min_budget=None, max_budget=None, max_pairs=32,
+                 pair_overhead=16, answer_tokens=8, grow_step=60, shrink=0.7,
+                 latency_slack=1.25, window=8, max_failure_rate=0.1, template_tokens=0):
+        self.template_tokens = template_tokens
+        self.budget = budget
+        self.min_budget = template_tokens + 120 if min_budget is None else min_budget
+        self.max_budget = template_tokens + 2400 if max_budget is None else max_budget
+        self.max_pairs = max_pairs
+        self.pair_overhead = pair_overhead
+        self.answer_tokens = answer_tokens
+        self.grow_step = grow_step
+        self.shrink = shrink
+        self.latency_slack = latency_slack
+        self.max_failure_rate = max_failure_rate
+        self._recent = deque(maxlen=window)
+        self.history = [budget]
+        self._best_per_pair = None
+
+    def pair_tokens(self, row):
+        return (estimate_tokens(row["expected_error"])
+                + estimate_tokens(row["student_error"])
+                + self.pair_overhead)
+
+    def max_tokens_for(self, batch):
+        """Generation budget for one batch: a few tokens per answer plus slack."""
+        return self.answer_tokens * len(batch) + 16
+
+    def batches(self, rows):
+        """
+        Yield batches lazily, so budget changes made through record() apply
+        to the very next batch.
+        """
+        i = 0
+        while i < len(rows):
+            batch = [rows[i]]
+            used = self.template_tokens + self.pair_tokens(rows[i])
+            i += 1
+            while i < len(rows) and len(batch) < self.max_pairs:
+                cost = self.pair_tokens(rows[i])
+                if used + cost > self.budget:
+                    break
+                batch.append(rows[i])
+                used += cost
+                i += 1
+            yield batch
+
+    def record(self, batch_len, latency_sec, failed):
+        """
+        Feed back one batch: its size, wall time, and whether the model's
+        answer needed recovery (parse failure or missing pairs).
+        """
+        per_pair = latency_sec / max(batch_len, 1)
+        self._recent.append(bool(failed))
+        if failed and sum(self._recent) / len(self._recent) > self.max_failure_rate:
+            self.budget = max(self.min_budget, int(self.budget * self.shrink))
+        elif not failed and (self._best_per_pair is None
+                             or per_pair <= self._best_per_pair * self.latency_slack):
+            self.budget = min(self.max_budget, self.budget + self.grow_step)
+        if self._best_per_pair is None or per_pair < self._best_per_pair:
+            self._best_per_pair = per_pair
+        self.history.append(self.budget)
+
+    def summary(self):
+        return (f"Token budget: start {self.history[0]}, end {self.budget}, "
+                f"range {min(self.history)}-{max(self.history)}")
@@ -0,0 +1,257 @@
+import argparse
+import contextlib
+import functools
+import importlib
+import io
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime, timezone
+from pathlib import Path
+import prompts
+from judge_cache import VerdictCache
+from embedding_store import EmbeddingStore
+import numpy as np
+from evaluation import evaluate_file
+
+SYNTH_PATH = Path("../data/synthetic.jsonl")
+REPORT_DIR = Path("../data/benchmarks")
+
+# Strategy name -> script module, or (module, constants to override)
+STRATEGIES = {
+    "sequential": "2_judge_pairs",
+    "parallel": "2_judge_pairs_parallel",
+    "async": "2_judge_pairs_async",
+    "async_hedged": ("2_judge_pairs_async", {"HEDGE_QUANTILE": 0.95}),
+    "batched": "2_judge_pairs_batched",
+    "batched_v2": "2_judge_pairs_batched_v2",
+    "batched_parallel": "2_judge_pairs_batched_parallel",
+    "cascade": "2_judge_pairs_cascade",
+    "lexicon": "2_judge_pairs_lexicon",
+    "sentence_transform": "sentence_transform",
+}
+
+# Metrics where a higher value is better; everything else is a time
+HIGHER_IS_BETTER = {"pairs_per_sec", "accuracy", "f1_true", "f1_false"}
+
+# Relative change that counts as a regression in --compare
+REGRESSION_TOLERANCE = 0.10
+
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    commit = git("rev-parse", "--short", "HEAD")
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": commit, "dirty": bool(status) if status is not None else None}
+
+
+def percentile(sorted_vals, q):
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(int(len(sorted_vals) * q), len(sorted_vals) - 1)]
+
+
+def run_once(name, dataset, workdir, warm_cache):
+    """
+    One run of one strategy in-process. The script module is reloaded so
+    module-level state (batchers, limiters) starts fresh, and pointed at
+    `dataset` and a scratch judgments file. Unless warm_cache, each run gets
+    an empty verdict cache and embedding store so every pair costs a real
+    model call. The cascade band is fit once per benchmark, in workdir, so
+    the user's data/cascade_band.json is never read or overwritten.
+    """
+    spec = STRATEGIES[name]
+    module, overrides = spec if isinstance(spec, tuple) else (spec, {})
+    mod = importlib.reload(importlib.import_module(module))
+    for attr, value in overrides.items():
+        setattr(mod, attr, value)
+    judge_path = workdir / f"{name}.jsonl"
+    mod.SYNTH_PATH = Path(dataset)
+    for attr, value in [("JUDGE_PATH", judge_path), ("RESUME", False),
+                        ("COMPARE_SAMPLE", 0), ("CURVES_PATH", workdir / "curves.npz"),
+                        ("BAND_PATH", workdir / "cascade_band.json")]:
+        if hasattr(mod, attr):
+            setattr(mod, attr, value)
+    if hasattr(mod, "VerdictCache") and not warm_cache:
+        cache_path = workdir / f"{name}_cache.sqlite"
+        for p in workdir.glob(f"{name}_cache.sqlite*"):
+            p.unlink()
+        mod.VerdictCache = functools.partial(VerdictCache, cache_path)
+    if hasattr(mod, "EmbeddingStore"):
+        store_dir = workdir / "embeddings"
+        if not warm_cache:
+            shutil.rmtree(store_dir, ignore_errors=True)
+        mod.EmbeddingStore = functools.partial(EmbeddingStore, root=store_dir)
+
+    log = io.StringIO()
+    t0 = time.time()
+    with contextlib.redirect_stdout(log):
+        stats = mod.main() or {}
+    wall_secs = time.time() - t0
+
+    result = {
+        "wall_secs": wall_secs,
+        "warmup_secs": stats.get("load_secs"),
+        "infer_secs": stats.get("infer_secs"),
+        "pairs": stats.get("written"),
+        "hedge_rate": stats.get("hedge_rate"),
+        "fast_path_rate": stats.get("fast_path_rate"),
+    }
+    if judge_path.exists():
+        ev = evaluate_file(judge_path, error_sample=0, bootstrap=0)
+        m = ev["metrics"]
+        lat = ev["latency"]
+        lat = np.sort(lat[~np.isnan(lat)]).tolist()
+        result.update(pairs=ev["total"], accuracy=m["accuracy"],
+                      f1_true=m["f1_true"], f1_false=m["f1_false"])
+    else:
+        # No judgments file (sentence_transform): metrics come from main()
+        lat = []
+        result.update({k: stats.get(k) for k in ("accuracy", "f1_true", "f1_false")})
+
+    infer = result["infer_secs"] or wall_secs
+    result["pairs_per_sec"] = (result["pairs"] or 0) / infer if infer > 0 else None
+    result["p50_ms"] = percentile(lat, 0.50) * 1000.0 if lat else None
+    result["p95_ms"] = percentile(lat, 0.95) * 1000.0 if lat else None
+    result["p99_ms"] = percentile(lat, 0.99) * 1000.0 if lat else None
+    return result, log.getvalue()
+
+
+def summarize(runs):
+    """Median of each numeric metric over the successful runs."""
+    summary = {}
+    for key in runs[0]:
+        vals = [r[key] for r in runs if isinstance(r.get(key), (int, float))]
+        summary[key] = statistics.median(vals) if vals else None
+    return summary
+
+
+def compare(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Lines describing each metric's change vs. a previous report, and the regressions."""
+    lines, regressions = [], []
+    for name, res in report["results"].items():
+        old = baseline.get("results", {}).get(name, {}).get("median")
+        new = res.get("median")
+        if not old or not new:
+            continue
+        for key in ("pairs_per_sec", "p50_ms", "p95_ms", "p99_ms", "warmup_secs", "accuracy", "f1_true"):
+            a, b = old.get(key), new.get(key)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            worse = -change if key in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > tolerance:
+                flag = "  << REGRESSION"
+                regressions.append(f"{name}.{key}")
+            lines.append(f"  {name:<18} {key:<14} {a:10.3f} -> {b:10.3f} ({change:+.1%}){flag}")
+    return lines, regressions
+
+
+def print_table(report):
+    cols = ["pairs_per_sec", "p50_ms", "p95_ms", "p99_ms", "warmup_secs", "accuracy", "f1_true"]
+    print(f"{'strategy':<18} " + " ".join(f"{c:>13}" for c in cols))
+    for name, res in report["results"].items():
+        if "error" in res:
+            print(f"{name:<18} failed: {res['error']}")
+            continue
+        med = res["median"]
+        cells = [f"{med[c]:13.3f}" if med.get(c) is not None else f"{'-':>13}" for c in cols]
+        print(f"{name:<18} " + " ".join(cells))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark judging strategies on one dataset.")
+    p.add_argument("strategies", nargs="*", default=["sequential", "parallel"],
+                   help=f"any of: {', '.join(STRATEGIES)} (or 'all')")
+    p.add_argument("--dataset", default=str(SYNTH_PATH))
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--warm-cache", action="store_true",
+                   help="reuse the verdict cache between runs instead of starting cold")
+    p.add_argument("--out", help="report path (default: data/benchmarks/<commit>_<time>.json)")
+    p.add_argument("--compare", help="previous report to diff against; exit 1 on regression")
+    p.add_argument("--verbose", action="store_true", help="echo each script's own output")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = list(STRATEGIES) if args.strategies == ["all"] else args.strategies
+    unknown = [n for n in names if n not in STRATEGIES]
+    if unknown:
+        sys.exit(f"unknown strategies: {', '.join(unknown)}")
+
+    with open(args.dataset, encoding="utf-8") as f:
+        dataset_rows = sum(1 for _ in f)
+
+    git = git_info()
+    report = {
+        "git_commit": git["commit"],
+        "git_dirty": git["dirty"],
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "ollama_urls": prompts.OLLAMA_URLS,
+        "model": prompts.DEFAULT_MODEL,
+        "dataset": args.dataset,
+        "dataset_rows": dataset_rows,
+        "repeat": args.repeat,
+        "warm_cache": args.warm_cache,
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        workdir = Path(tmp)
+        for name in names:
+            runs = []
+            try:
+                for i in range(args.repeat):
+                    result, log = run_once(name, args.dataset, workdir, args.warm_cache)
+                    runs.append(result)
+                    if args.verbose:
+                        print(log)
+                    print(f"[{name} {i + 1}/{args.repeat}] {result['pairs']} pairs, "
+                          f"{result['pairs_per_sec'] or 0:.2f} pairs/sec", file=sys.stderr)
+            except Exception as e:  # a missing optional dependency shouldn't sink the report
+                report["results"][name] = {"error": f"{type(e).__name__}: {e}", "runs": runs}
+                if args.verbose:
+                    traceback.print_exc()
+                continue
+            report["results"][name] = {"runs": runs, "median": summarize(runs)}
+
+    out = Path(args.out) if args.out else (
+        REPORT_DIR / f"{git['commit'] or 'nogit'}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open("w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print_table(report)
+    print(f"\nReport written to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        lines, regressions = compare(report, baseline)
+        print(f"\n=== vs {args.compare} ({baseline.get('git_commit')}) ===")
+        print("\n".join(lines) or "  nothing comparable")
+        if regressions:
+            print(f"\nRegressions beyond {REGRESSION_TOLERANCE:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+    return report
+
+
+if __name__ == "__main__":
+    main()
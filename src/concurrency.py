@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class AIMDLimiter:
+    """
+    Adaptive in-flight limit for the thread-based judges.
+
+    Works like a semaphore whose size changes at runtime. Every `window`
+    completed calls the controller looks at the window's throughput and p95.
+    If any call failed, or p95 went past `latency_slack` times the baseline
+    while throughput stopped improving, the limit is multiplied by
+    `decrease`. Otherwise it keeps probing upward by `increase`.
+
+    The baseline is the best p95 of the last `baseline_windows` windows, not
+    of the whole run: a lucky early window would otherwise stay the
+    reference forever, and normal drift above it would keep cutting the limit.
+    The window right after a cut still carries the queue built under the old
+    limit, so it holds the limit instead of judging latency.
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=64, window=16,
+                 increase=2, decrease=0.5, latency_slack=1.5, baseline_windows=8):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_slack = latency_slack
+
+        self.in_flight = 0
+        self.history = [initial]
+        self._cond = threading.Condition()
+        self._latencies = []
+        self._errors = 0
+        self._window_start = time.time()
+        self._last_throughput = 0.0
+        self._recent_p95 = deque(maxlen=baseline_windows)
+        self._just_cut = False
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency_sec, ok=True):
+        with self._cond:
+            self.in_flight -= 1
+            self._latencies.append(latency_sec)
+            if not ok:
+                self._errors += 1
+            if len(self._latencies) >= self.window:
+                self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        now = time.time()
+        elapsed = max(now - self._window_start, 1e-9)
+        throughput = len(self._latencies) / elapsed
+        lat_sorted = sorted(self._latencies)
+        p95 = lat_sorted[int(len(lat_sorted) * 0.95)]
+
+        self._recent_p95.append(p95)
+        baseline = min(self._recent_p95)
+
+        # Congestion: failures, or latency growing without buying throughput
+        slow = (p95 > baseline * self.latency_slack
+                and throughput <= self._last_throughput * 1.05)
+        if self._errors or (slow and not self._just_cut):
+            new_limit = max(self.min_limit, int(self.limit * self.decrease))
+        elif self._just_cut:
+            new_limit = self.limit
+        else:
+            new_limit = min(self.max_limit, self.limit + self.increase)
+        self._just_cut = new_limit < self.limit
+
+        self.limit = new_limit
+        self.history.append(new_limit)
+        self._last_throughput = throughput
+        self._latencies = []
+        self._errors = 0
+        self._window_start = now
+
+    def settled_limit(self):
+        """Most common limit over the last few windows (latest wins ties)."""
+        recent = self.history[-8:]
+        return max(reversed(recent), key=recent.count)
+
+    @contextmanager
+    def slot(self):
+        """Hold one in-flight slot for the duration of the block, feeding its latency back."""
+        self.acquire()
+        t0 = time.time()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.release(time.time() - t0, ok)
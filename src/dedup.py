@@ -0,0 +1,112 @@
+import hashlib
+import json
+import re
+from pathlib import Path
+
+JOBS_PATH = Path("../data/jobs.jsonl")
+
+_MARKER_RE = re.compile(r"^\s*student compiler\s*:\s*", re.IGNORECASE)
+_LINE_PREFIX_RE = re.compile(r"^\s*line\s+\d+\s*[:,\-]\s*", re.IGNORECASE)
+_QUOTES_RE = re.compile(r"[\"'`‘’“”´]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def canonicalize(text):
+    """
+    Canonical form used only for grouping: the judge still sees the original
+    wording of the first row in each group.
+    """
+    text = _MARKER_RE.sub("", text)
+    text = _LINE_PREFIX_RE.sub("", text)
+    text = _QUOTES_RE.sub("'", text)
+    text = _SPACE_RE.sub(" ", text)
+    return text.strip().casefold()
+
+
+def build_jobs(rows):
+    """
+    Collapse rows with the same canonical (expected, student) pair into one
+    judge job. Each job keeps the indices of the rows it stands for.
+    """
+    jobs = []
+    by_key = {}
+    for i, row in enumerate(rows):
+        key = (canonicalize(row["expected_error"]), canonicalize(row["student_error"]))
+        job = by_key.get(key)
+        if job is None:
+            job = {
+                "expected_error": row["expected_error"],
+                "student_error": row["student_error"],
+                "rows": [],
+            }
+            by_key[key] = job
+            jobs.append(job)
+        job["rows"].append(i)
+    return jobs
+
+
+def row_hash(row):
+    """Hash of a row's text, so a jobs file can tell it was built from other rows."""
+    text = row["expected_error"] + "\0" + row["student_error"]
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def write_jobs(jobs, rows, path=JOBS_PATH):
+    with Path(path).open("w", encoding="utf-8") as f:
+        for job in jobs:
+            f.write(json.dumps({
+                "expected_error": job["expected_error"],
+                "student_error": job["student_error"],
+                "test_ids": [rows[i]["test_id"] for i in job["rows"]],
+                "row_hashes": [row_hash(rows[i]) for i in job["rows"]],
+            }, ensure_ascii=False) + "\n")
+
+
+def load_jobs(rows, path=JOBS_PATH):
+    """
+    Read the jobs written by 1b_dedup_pairs.py. If the file is missing or was
+    built from different rows (other test_ids, or the same test_ids with other
+    text, as after regenerating synthetic.jsonl), dedupe in memory instead.
+    """
+    path = Path(path)
+    if not path.exists():
+        return build_jobs(rows)
+
+    index_by_id = {row["test_id"]: i for i, row in enumerate(rows)}
+    jobs = []
+    seen = 0
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            data = json.loads(line)
+            try:
+                idxs = [index_by_id[t] for t in data["test_ids"]]
+                hashes = data["row_hashes"]
+            except KeyError:
+                return build_jobs(rows)
+            if hashes != [row_hash(rows[i]) for i in idxs]:
+                return build_jobs(rows)
+            seen += len(idxs)
+            jobs.append({
+                "expected_error": data["expected_error"],
+                "student_error": data["student_error"],
+                "rows": idxs,
+            })
+    if seen != len(rows):
+        return build_jobs(rows)
+    return jobs
+
+
+def fan_out(jobs, verdicts, rows):
+    """
+    Copy each job's verdict fields onto every original row it represents.
+    Rows come back in their original order.
+    """
+    judged_rows = [None] * len(rows)
+    for job, verdict in zip(jobs, verdicts):
+        for i in job["rows"]:
+            judged_rows[i] = {**rows[i], **verdict}
+    return judged_rows
+
+
+def dedup_ratio(jobs, rows):
+    return len(rows) / len(jobs) if jobs else 1.0
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+STORE_DIR = Path("../data/embeddings")
+
+# Rows per chunk when computing pair similarities straight off the memmap
+SIM_CHUNK = 65_536
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Persistent, append-only embedding table for one model.
+
+    vectors.npy is a (capacity, dim) .npy file opened as a memmap; index.json
+    maps text hash -> row. Only texts never seen before get encoded, and the
+    index is saved after the vectors are flushed, so it never points at rows
+    that didn't make it to disk.
+    """
+
+    def __init__(self, model_name, root=STORE_DIR, dtype=np.float16):
+        self.dir = Path(root) / model_name.replace("/", "__")
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.dir / "vectors.npy"
+        self.index_path = self.dir / "index.json"
+        self.dtype = np.dtype(dtype)
+        self.encoded = 0
+
+        if self.index_path.exists():
+            with self.index_path.open(encoding="utf-8") as f:
+                meta = json.load(f)
+            self.rows = meta["rows"]
+            self.count = meta["count"]
+            self._mm = np.load(self.vectors_path, mmap_mode="r+")
+            self.dtype = self._mm.dtype
+        else:
+            self.rows = {}
+            self.count = 0
+            self._mm = None  # created on first encode, once dim is known
+
+    @property
+    def vectors(self):
+        """Zero-copy view of every stored vector."""
+        if self._mm is None:
+            return np.empty((0, 0), dtype=self.dtype)
+        return self._mm[:self.count]
+
+    def _ensure_capacity(self, needed, dim):
+        if self._mm is not None and needed <= self._mm.shape[0]:
+            return
+        capacity = max(needed, 1024, 2 * (self._mm.shape[0] if self._mm is not None else 0))
+        tmp_path = self.dir / "vectors.tmp.npy"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype,
+                                          shape=(capacity, dim))
+        if self._mm is not None:
+            grown[:self.count] = self._mm[:self.count]
+        grown.flush()
+        del grown
+        self._mm = None
+        os.replace(tmp_path, self.vectors_path)
+        self._mm = np.load(self.vectors_path, mmap_mode="r+")
+
+    def _save_index(self):
+        tmp_path = self.dir / "index.tmp.json"
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"count": self.count, "rows": self.rows}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def rows_for(self, texts, encode):
+        """
+        Row index of each text in the store. `encode(list_of_texts)` is only
+        called on distinct texts that are not stored yet.
+        """
+        hashes = [text_hash(t) for t in texts]
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in self.rows and h not in missing:
+                missing[h] = t
+
+        if missing:
+            new_vecs = np.asarray(encode(list(missing.values())))
+            self._ensure_capacity(self.count + len(missing), new_vecs.shape[1])
+            self._mm[self.count:self.count + len(missing)] = new_vecs.astype(self.dtype)
+            self._mm.flush()
+            for offset, h in enumerate(missing):
+                self.rows[h] = self.count + offset
+            self.count += len(missing)
+            self.encoded += len(missing)
+            self._save_index()
+
+        return np.fromiter((self.rows[h] for h in hashes), dtype=np.int64, count=len(hashes))
+
+    def pair_sims(self, rows_a, rows_b):
+        """
+        Dot product of vectors[rows_a[i]] and vectors[rows_b[i]], i.e. cosine
+        similarity for normalized embeddings. Works in chunks so memory stays
+        bounded however many pairs there are.
+        """
+        vecs = self.vectors
+        sims = np.empty(len(rows_a), dtype=np.float32)
+        for start in range(0, len(rows_a), SIM_CHUNK):
+            a = vecs[rows_a[start:start + SIM_CHUNK]].astype(np.float32)
+            b = vecs[rows_b[start:start + SIM_CHUNK]].astype(np.float32)
+            sims[start:start + SIM_CHUNK] = np.einsum("ij,ij->i", a, b)
+        return sims
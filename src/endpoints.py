@@ -0,0 +1,173 @@
+import itertools
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or "/"
+        self.base = f"{parts.scheme}://{parts.hostname}:{self.port}"
+        self.outstanding = 0
+        self.latency_ewma = None
+        self.failures = 0  # consecutive
+        self.ejected_until = None
+        self.ejections = 0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def healthy(self):
+        return self.ejected_until is None
+
+    def __repr__(self):
+        return f"Endpoint({self.base})"
+
+
+class EndpointPool:
+    """
+    Several Ollama servers behind one call site.
+
+    Requests go to the healthy endpoint with the fewest requests outstanding
+    (ties: lowest latency EWMA, then round robin). An endpoint is ejected
+    after `eject_after` consecutive failures, or when its latency EWMA is
+    more than `slow_factor` times the median of the others (after
+    `min_samples` good calls, so a cold model load doesn't count). Ejected
+    endpoints get no traffic until the health checker (GET /api/tags every
+    `check_every` seconds) sees them answer again after `eject_secs`; the
+    ejection time doubles each time it happens again, up to
+    `max_eject_secs`. If every endpoint is ejected, traffic goes to them
+    anyway rather than failing outright. A pool of one never ejects.
+    """
+
+    def __init__(self, urls, eject_after=3, eject_secs=5.0, max_eject_secs=60.0,
+                 slow_factor=3.0, min_samples=10, ewma_alpha=0.2, check_every=2.0,
+                 check_timeout=2.0):
+        self.endpoints = [Endpoint(u) for u in urls]
+        self.eject_after = eject_after
+        self.eject_secs = eject_secs
+        self.max_eject_secs = max_eject_secs
+        self.slow_factor = slow_factor
+        self.min_samples = min_samples
+        self.ewma_alpha = ewma_alpha
+        self.check_every = check_every
+        self.check_timeout = check_timeout
+        self.events = []
+        self._rr = itertools.count()
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self, exclude=()):
+        """Pick an endpoint for one request and count it as outstanding."""
+        self._start_checker()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+            healthy = [e for e in candidates if e.healthy] or candidates
+            turn = next(self._rr)
+            ep = min(healthy, key=lambda e: (
+                e.outstanding,
+                e.latency_ewma if e.latency_ewma is not None else 0.0,
+                (self.endpoints.index(e) - turn) % len(self.endpoints),
+            ))
+            ep.outstanding += 1
+            ep.requests += 1
+            return ep
+
+    def release(self, ep, latency_sec=None, ok=True):
+        """Finish a request; latency_sec None means it never reached the server."""
+        with self._lock:
+            ep.outstanding -= 1
+            if ok and latency_sec is None:
+                return
+            if not ok:
+                ep.errors += 1
+                ep.failures += 1
+                if ep.healthy and ep.failures >= self.eject_after:
+                    self._eject(ep, f"{ep.failures} consecutive failures")
+                return
+            ep.failures = 0
+            a = self.ewma_alpha
+            ep.latency_ewma = latency_sec if ep.latency_ewma is None else (
+                a * latency_sec + (1 - a) * ep.latency_ewma)
+            others = [e.latency_ewma for e in self.endpoints
+                      if e is not ep and e.healthy and e.latency_ewma is not None]
+            if ep.healthy and others and ep.requests - ep.errors >= self.min_samples:
+                typical = statistics.median(others)
+                if ep.latency_ewma > self.slow_factor * typical:
+                    self._eject(ep, f"slow: {ep.latency_ewma:.3f}s vs {typical:.3f}s")
+
+    def _eject(self, ep, reason):
+        if len(self.endpoints) < 2:
+            return
+        ep.ejections += 1
+        secs = min(self.eject_secs * 2 ** (ep.ejections - 1), self.max_eject_secs)
+        ep.ejected_until = time.time() + secs
+        self.events.append((time.time(), ep.base, "ejected", reason))
+
+    def _readmit(self, ep):
+        with self._lock:
+            ep.ejected_until = None
+            ep.failures = 0
+            # Start from the pool's typical latency, not the value that got it ejected
+            ewmas = [e.latency_ewma for e in self.endpoints
+                     if e.healthy and e is not ep and e.latency_ewma is not None]
+            ep.latency_ewma = statistics.median(ewmas) if ewmas else None
+            self.events.append((time.time(), ep.base, "readmitted", ""))
+
+    def check(self, ep):
+        try:
+            r = requests.get(f"{ep.base}/api/tags", timeout=self.check_timeout)
+            return r.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.check_every)
+            for ep in self.endpoints:
+                if ep.healthy:
+                    if not self.check(ep):
+                        with self._lock:
+                            if ep.healthy:
+                                self._eject(ep, "health check failed")
+                elif time.time() >= ep.ejected_until and self.check(ep):
+                    self._readmit(ep)
+
+    def _start_checker(self):
+        # A single endpoint has nowhere else to send traffic: skip the checks
+        if self._checker is None and len(self.endpoints) > 1:
+            with self._lock:
+                if self._checker is None:
+                    self._checker = threading.Thread(target=self._check_loop, daemon=True)
+                    self._checker.start()
+
+    def stats(self):
+        with self._lock:
+            return [{
+                "endpoint": e.base,
+                "healthy": e.healthy,
+                "requests": e.requests,
+                "errors": e.errors,
+                "ejections": e.ejections,
+                "outstanding": e.outstanding,
+                "latency_ewma_ms": e.latency_ewma * 1000.0 if e.latency_ewma is not None else None,
+            } for e in self.endpoints]
+
+    def print_stats(self):
+        if len(self.endpoints) < 2:
+            return
+        print(f"Endpoint pool ({len(self.endpoints)} servers):")
+        for s in self.stats():
+            ewma = f"{s['latency_ewma_ms']:.1f}ms" if s["latency_ewma_ms"] is not None else "-"
+            print(f"  {s['endpoint']:<28} {'up' if s['healthy'] else 'EJECTED':<8} "
+                  f"requests {s['requests']:>6}  errors {s['errors']:>4}  "
+                  f"ejections {s['ejections']:>2}  latency ewma {ewma}")
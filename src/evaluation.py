@@ -0,0 +1,344 @@
+import hashlib
+import json
+import math
+import os
+import random
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Files are parsed in byte ranges of this size, one per worker task
+CHUNK_BYTES = 16 * 1024 * 1024
+
+MAX_WORKERS = os.cpu_count() or 1
+
+# Confusion cell of a row is label * 2 + pred: 0 = TN, 1 = FP, 2 = FN, 3 = TP
+TN, FP, FN, TP = range(4)
+
+
+def test_file(test_id):
+    """"v2.1.yaml::12" -> "v2.1.yaml" (ids without "::" are their own file)."""
+    return test_id.split("::", 1)[0]
+
+
+def gold_test(test_id):
+    """
+    test_id of the gold test a synthetic row came from: without the "~k"
+    paraphrase suffix and the "_neg" negative-pair suffix, so "f::3_neg~2"
+    and "f::3" belong together.
+    """
+    base = test_id.split("~", 1)[0]
+    return base[:-len("_neg")] if base.endswith("_neg") else base
+
+
+def test_key(test_id):
+    """64-bit hash of a test_id, for joining runs without keeping the strings."""
+    return int.from_bytes(hashlib.blake2b(test_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _scan_range(path, start, end, error_sample, seed, keys=False):
+    """
+    Parse the lines whose first byte lies in [start, end). Returns compact
+    columns plus a uniform sample (reservoir) of the wrong rows. With keys,
+    also the test_id hash and byte offset of every row.
+    """
+    labels = bytearray()
+    preds = bytearray()
+    files = array("I")
+    latency = array("f")
+    key_col = array("Q")
+    offsets = array("Q")
+    names = {}
+    errors = []
+    n_errors = 0
+    bad_lines = 0
+    rng = random.Random(seed + start)
+
+    with open(path, "rb") as f:
+        pos = start
+        if start:
+            # Skip the tail of a line that started in the previous range
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())
+        # Whole range in one read, plus the rest of its last line
+        block = f.read(max(end - pos, 0))
+        if block and not block.endswith(b"\n"):
+            block += f.readline()
+
+    offset = pos
+    for line in block.split(b"\n"):
+        line_offset = offset
+        offset += len(line) + 1
+        if not line.strip():
+            continue
+        try:
+            r = json.loads(line)
+            label, pred = bool(r["label"]), bool(r["model_bool"])
+        except (ValueError, KeyError):
+            bad_lines += 1  # e.g. a torn last line from an interrupted run
+            continue
+        test_id = r.get("test_id", "")
+        labels.append(label)
+        preds.append(pred)
+        files.append(names.setdefault(test_file(test_id), len(names)))
+        if keys:
+            key_col.append(test_key(test_id))
+            offsets.append(line_offset)
+        lat = r.get("latency_sec")
+        latency.append(lat if lat is not None and not r.get("cached") else float("nan"))
+        if label != pred:
+            n_errors += 1
+            if len(errors) < error_sample:
+                errors.append(r)
+            else:
+                j = rng.randrange(n_errors)
+                if j < error_sample:
+                    errors[j] = r
+
+    return {
+        "label": np.frombuffer(bytes(labels), dtype=np.bool_),
+        "pred": np.frombuffer(bytes(preds), dtype=np.bool_),
+        "file": np.frombuffer(files, dtype=np.uint32).copy(),
+        "latency": np.frombuffer(latency, dtype=np.float32).copy(),
+        "key": np.frombuffer(key_col, dtype=np.uint64).copy(),
+        "offset": np.frombuffer(offsets, dtype=np.uint64).copy(),
+        "names": list(names),
+        "errors": errors,
+        "n_errors": n_errors,
+        "bad_lines": bad_lines,
+    }
+
+
+def _merge_errors(parts, error_sample, seed):
+    """Uniform sample of all wrong rows from per-range reservoirs."""
+    counts = [p["n_errors"] for p in parts]
+    total = sum(counts)
+    if total == 0 or error_sample == 0:
+        return []
+    rng = np.random.default_rng(seed)
+    take = rng.multivariate_hypergeometric(counts, min(error_sample, total))
+    picked = []
+    for part, k in zip(parts, take):
+        idx = rng.choice(len(part["errors"]), size=k, replace=False)
+        picked.extend(part["errors"][i] for i in sorted(idx))
+    return picked
+
+
+def scan_judgments(path, error_sample=20, seed=0, max_workers=MAX_WORKERS, keys=False):
+    """
+    Stream a judgments file into NumPy columns, one byte per row for the
+    booleans: label, pred, file (index into `files`, the test_id prefix)
+    and latency (NaN for cache hits). Large files are parsed in parallel
+    byte ranges. Only `error_sample` wrong rows are kept as dicts.
+
+    With keys, "key" (test_key of each row) and "offset" (byte offset of
+    its line, see read_rows) are filled in too.
+    """
+    size = os.path.getsize(path)
+    ranges = [(s, min(s + CHUNK_BYTES, size)) for s in range(0, size, CHUNK_BYTES)] or [(0, 0)]
+    if len(ranges) == 1 or max_workers <= 1:
+        parts = [_scan_range(path, s, e, error_sample, seed, keys) for s, e in ranges]
+    else:
+        n = len(ranges)
+        with ProcessPoolExecutor(max_workers=min(max_workers, n)) as ex:
+            parts = list(ex.map(_scan_range, [path] * n, *zip(*ranges),
+                                [error_sample] * n, [seed] * n, [keys] * n))
+
+    # Per-range file codes -> one global code table
+    files = {}
+    file_cols = []
+    for part in parts:
+        remap = np.array([files.setdefault(n, len(files)) for n in part["names"]] or [0],
+                         dtype=np.uint32)
+        file_cols.append(remap[part["file"]])
+
+    return {
+        "label": np.concatenate([p["label"] for p in parts]),
+        "pred": np.concatenate([p["pred"] for p in parts]),
+        "file": np.concatenate(file_cols),
+        "latency": np.concatenate([p["latency"] for p in parts]),
+        "key": np.concatenate([p["key"] for p in parts]),
+        "offset": np.concatenate([p["offset"] for p in parts]),
+        "files": list(files),
+        "errors": _merge_errors(parts, error_sample, seed),
+        "n_errors": sum(p["n_errors"] for p in parts),
+        "bad_lines": sum(p["bad_lines"] for p in parts),
+    }
+
+
+def confusion_counts(label, pred):
+    """[TN, FP, FN, TP] counts from boolean columns."""
+    cells = label.astype(np.intp) * 2 + pred
+    return np.bincount(cells, minlength=4)
+
+
+def per_file_counts(label, pred, file, n_files):
+    """(n_files, 4) confusion counts, one row per test file."""
+    cells = file.astype(np.intp) * 4 + label.astype(np.intp) * 2 + pred
+    return np.bincount(cells, minlength=n_files * 4).reshape(n_files, 4)
+
+
+def _ratio(num, den):
+    num = np.asarray(num, dtype=np.float64)
+    den = np.asarray(den, dtype=np.float64)
+    out = np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den > 0)
+    return out if out.ndim else float(out)
+
+
+def metrics_from_counts(counts):
+    """
+    Accuracy and per-class precision/recall/F1. `counts` is [TN, FP, FN, TP]
+    along the last axis, so a (B, 4) array gives B sets of metrics at once.
+    """
+    counts = np.asarray(counts)
+    tn, fp, fn, tp = (counts[..., i] for i in range(4))
+    precision_true = _ratio(tp, tp + fp)
+    recall_true = _ratio(tp, tp + fn)
+    precision_false = _ratio(tn, tn + fn)
+    recall_false = _ratio(tn, tn + fp)
+    return {
+        "accuracy": _ratio(tp + tn, tn + fp + fn + tp),
+        "precision_true": precision_true,
+        "recall_true": recall_true,
+        "f1_true": _ratio(2 * precision_true * recall_true, precision_true + recall_true),
+        "precision_false": precision_false,
+        "recall_false": recall_false,
+        "f1_false": _ratio(2 * precision_false * recall_false, precision_false + recall_false),
+    }
+
+
+def bootstrap_ci(counts, samples=2000, level=0.95, seed=0):
+    """
+    Percentile bootstrap interval of every metric. Resampling rows with
+    replacement only changes the confusion counts, so each replicate is one
+    multinomial draw over the 4 cells: cost is independent of the row count.
+    """
+    counts = np.asarray(counts)
+    n = int(counts.sum())
+    if n == 0:
+        return {}
+    rng = np.random.default_rng(seed)
+    reps = rng.multinomial(n, counts / n, size=samples)
+    alpha = (1 - level) / 2
+    return {k: (float(np.quantile(v, alpha)), float(np.quantile(v, 1 - alpha)))
+            for k, v in metrics_from_counts(reps).items()}
+
+
+def evaluate_file(path, error_sample=20, bootstrap=2000, seed=0):
+    """Everything 3_eval_judge.py and benchmark.py report about one judgments file."""
+    cols = scan_judgments(path, error_sample=error_sample, seed=seed)
+    counts = confusion_counts(cols["label"], cols["pred"])
+    return {
+        "total": int(counts.sum()),
+        "counts": {"tn": int(counts[TN]), "fp": int(counts[FP]),
+                   "fn": int(counts[FN]), "tp": int(counts[TP])},
+        "metrics": metrics_from_counts(counts),
+        "ci": bootstrap_ci(counts, samples=bootstrap, seed=seed) if bootstrap else {},
+        "per_file": dict(zip(cols["files"], per_file_counts(
+            cols["label"], cols["pred"], cols["file"], len(cols["files"])))),
+        "latency": cols["latency"],
+        "errors": cols["errors"],
+        "n_errors": cols["n_errors"],
+        "bad_lines": cols["bad_lines"],
+    }
+
+
+def read_rows(path, offsets):
+    """The judged rows starting at the given byte offsets, in the same order."""
+    rows = {}
+    with open(path, "rb") as f:
+        for off in sorted(set(int(o) for o in offsets)):
+            f.seek(off)
+            rows[off] = json.loads(f.readline())
+    return [rows[int(o)] for o in offsets]
+
+
+def _last_per_key(key):
+    """Sorted unique keys and the index of the last row with each (reruns append)."""
+    uniq, first_rev = np.unique(key[::-1], return_index=True)
+    return uniq, len(key) - 1 - first_rev
+
+
+def mcnemar(b, c):
+    """
+    Two-sided McNemar p-value for b vs. c discordant pairs: exact binomial
+    for small counts, chi-square with continuity correction otherwise.
+    """
+    n = b + c
+    if n == 0:
+        return 1.0
+    if n <= 1000:
+        k = min(b, c)
+        tail = sum(math.comb(n, i) for i in range(k + 1)) / 2 ** n
+        return min(1.0, 2 * tail)
+    chi2 = (abs(b - c) - 1) ** 2 / n
+    return math.erfc(math.sqrt(chi2 / 2))
+
+
+def compare_files(path_a, path_b, flip_sample=20, bootstrap=2000, seed=0):
+    """
+    Run-to-run diff of two judgments files, joined on test_id by hash. Only
+    the compact columns of each file are held in memory; the text of the
+    sampled flipped pairs is read back by byte offset.
+
+    Metric deltas are B - A over the pairs judged in both runs, with a
+    paired bootstrap: every pair falls into one of 8 cells (label, pred A,
+    pred B), and each replicate is a multinomial draw over those cells.
+    """
+    a = scan_judgments(path_a, error_sample=0, seed=seed, keys=True)
+    b = scan_judgments(path_b, error_sample=0, seed=seed, keys=True)
+    key_a, idx_a = _last_per_key(a["key"])
+    key_b, idx_b = _last_per_key(b["key"])
+    _, ja, jb = np.intersect1d(key_a, key_b, assume_unique=True, return_indices=True)
+    ia, ib = idx_a[ja], idx_b[jb]
+
+    label = a["label"][ia]
+    pred_a, pred_b = a["pred"][ia], b["pred"][ib]
+    right_a, right_b = pred_a == label, pred_b == label
+
+    cells = np.bincount(label.astype(np.intp) * 4 + pred_a.astype(np.intp) * 2 + pred_b,
+                        minlength=8).reshape(2, 2, 2)
+    counts_a = cells.sum(axis=2).reshape(4)
+    counts_b = cells.sum(axis=1).reshape(4)
+    metrics_a = metrics_from_counts(counts_a)
+    metrics_b = metrics_from_counts(counts_b)
+
+    ci = {}
+    n = int(cells.sum())
+    if bootstrap and n:
+        rng = np.random.default_rng(seed)
+        reps = rng.multinomial(n, cells.reshape(8) / n, size=bootstrap).reshape(-1, 2, 2, 2)
+        rep_a = metrics_from_counts(reps.sum(axis=3).reshape(-1, 4))
+        rep_b = metrics_from_counts(reps.sum(axis=2).reshape(-1, 4))
+        for k in rep_a:
+            delta = rep_b[k] - rep_a[k]
+            ci[k] = (float(np.quantile(delta, 0.025)), float(np.quantile(delta, 0.975)))
+
+    only_a_right = int(np.count_nonzero(right_a & ~right_b))
+    only_b_right = int(np.count_nonzero(right_b & ~right_a))
+
+    flipped = np.flatnonzero(pred_a != pred_b)
+    rng = np.random.default_rng(seed)
+    shown = np.sort(rng.choice(flipped, size=min(flip_sample, len(flipped)), replace=False))
+    flips = list(zip(read_rows(path_a, a["offset"][ia[shown]]),
+                     read_rows(path_b, b["offset"][ib[shown]])))
+
+    # Latency only where both runs made a real model call
+    lat_a, lat_b = a["latency"][ia], b["latency"][ib]
+    both = ~np.isnan(lat_a) & ~np.isnan(lat_b)
+
+    return {
+        "pairs_a": len(key_a),
+        "pairs_b": len(key_b),
+        "joined": n,
+        "label_changed": int(np.count_nonzero(label != b["label"][ib])),
+        "metrics_a": metrics_a,
+        "metrics_b": metrics_b,
+        "delta_ci": ci,
+        "flipped": len(flipped),
+        "flips": flips,
+        "only_a_right": only_a_right,
+        "only_b_right": only_b_right,
+        "mcnemar_p": mcnemar(only_a_right, only_b_right),
+        "latency_delta": (lat_b[both] - lat_a[both]).astype(np.float64),
+    }
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import deque
+
+
+def _pct(sorted_vals, q):
+    return sorted_vals[min(int(len(sorted_vals) * q), len(sorted_vals) - 1)]
+
+
+class HedgePolicy:
+    """
+    When to send a backup copy of a slow request.
+
+    The hedge delay is the `quantile` of recent primary-attempt latencies,
+    so only requests already slower than that get a duplicate. Until
+    `min_samples` calls have finished there is nothing to go on and nothing
+    is hedged. At most `max_rate` of all requests are hedged, so a general
+    slowdown (where every call crosses the delay) can't double the load.
+
+    `latencies` is what callers waited; `primary_latencies` is what they
+    would have waited without hedging. A primary that loses to its backup
+    is normally cancelled, so its entry is only a lower bound. With
+    track_primary=True it is left to finish instead (extra load on the
+    hedged calls only), giving its true latency; settle() waits for those.
+    """
+
+    def __init__(self, quantile=0.95, min_samples=20, window=500, max_rate=0.1,
+                 track_primary=False):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self.track_primary = track_primary
+        self.requests = 0
+        self.hedged = 0
+        self.backup_wins = 0
+        self.latencies = []
+        self.primary_latencies = []
+        self._recent = deque(maxlen=window)
+        self._tracked = set()
+
+    def delay(self):
+        """Seconds to wait before hedging the next request, or None to not hedge it."""
+        if len(self._recent) < self.min_samples:
+            return None
+        if self.hedged >= self.max_rate * self.requests:
+            return None
+        return _pct(sorted(self._recent), self.quantile)
+
+    def record(self, primary_sec, latency_sec):
+        """
+        primary_sec: how long the first attempt ran (up to its cancellation if
+        the backup won, so a lower bound then); latency_sec: what the caller
+        waited.
+        """
+        self._recent.append(primary_sec)
+        self.latencies.append(latency_sec)
+        self.primary_latencies.append(primary_sec)
+
+    def _track(self, primary, t0, slot):
+        """Leave a losing primary running and fill in its true latency when it ends."""
+        def done(task):
+            self._tracked.discard(task)
+            if not task.cancelled() and task.exception() is None:
+                self.primary_latencies[slot] = time.time() - t0
+        self._tracked.add(primary)
+        primary.add_done_callback(done)
+
+    async def settle(self):
+        """Wait for the primaries left running by track_primary."""
+        if self._tracked:
+            await asyncio.gather(*self._tracked, return_exceptions=True)
+
+    def summary(self):
+        rate = self.hedged / self.requests if self.requests else 0.0
+        wins = self.backup_wins / self.hedged if self.hedged else 0.0
+        line = (f"Hedged requests: {self.hedged} of {self.requests} ({rate:.1%}), "
+                f"backup won {self.backup_wins} ({wins:.0%})")
+        if self._recent:
+            line += f"; hedge delay now {_pct(sorted(self._recent), self.quantile) * 1000.0:.0f} ms"
+        if self.latencies:
+            bound = "" if self.track_primary else ">= "
+            line += (f"\nP99 latency: served {_pct(sorted(self.latencies), 0.99) * 1000.0:.0f} ms, "
+                     f"primary attempt alone {bound}"
+                     f"{_pct(sorted(self.primary_latencies), 0.99) * 1000.0:.0f} ms")
+        return line
+
+
+async def hedged(make_call, policy):
+    """
+    Result of make_call(route), hedged: if the first attempt hasn't finished
+    after policy.delay(), a second one starts and whichever finishes first
+    wins; the other is cancelled (for an HTTP stream that drops the
+    connection, so the server stops generating). `route` is a list shared by
+    both attempts, in which AsyncOllamaClient.generate records the endpoint
+    it used, so the backup goes to a different server when there is one.
+
+    If the first attempt to finish failed, the other one is still awaited.
+    """
+    policy.requests += 1
+    route = []
+    t0 = time.time()
+    primary = asyncio.ensure_future(make_call(route))
+    delay = policy.delay()
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+    except asyncio.CancelledError:
+        primary.cancel()
+        raise
+    if done:
+        elapsed = time.time() - t0
+        policy.record(elapsed, elapsed)
+        return primary.result()
+
+    policy.hedged += 1
+    backup = asyncio.ensure_future(make_call(route))
+    waiting = {primary, backup}
+    winner = None
+    try:
+        while True:
+            done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            # Prefer a success if both finished in the same tick
+            winner = min(done, key=lambda t: t.exception() is not None)
+            if winner.exception() is None or not waiting:
+                break
+    finally:
+        for t in (primary, backup):
+            if t.done():
+                continue
+            if t is primary and winner is backup and policy.track_primary:
+                continue  # left to finish so its true latency is known
+            t.cancel()
+
+    elapsed = time.time() - t0
+    if winner is backup:
+        policy.backup_wins += 1
+    policy.record(elapsed, elapsed)
+    if policy.track_primary and winner is backup and not primary.done():
+        policy._track(primary, t0, len(policy.primary_latencies) - 1)
+    return winner.result()
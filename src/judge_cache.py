@@ -0,0 +1,137 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from prompts import DEFAULT_MODEL, JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS
+
+CACHE_PATH = Path("../data/verdict_cache.sqlite")
+
+# Upper bound on stored verdicts; least-recently-used entries go first
+MAX_ENTRIES = 200_000
+
+# Hits only refresh last_used in memory; they reach SQLite in one
+# transaction every TOUCH_FLUSH hits, and on every put and on close
+TOUCH_FLUSH = 512
+
+
+def cache_key(model, template, temperature, max_tokens, expected_error, student_error):
+    """
+    Content address of one judgment: anything that can change the verdict
+    (model, prompt template, sampling temperature, generation cap, the two
+    messages). For batch templates max_tokens is the per-answer budget, not
+    the call's, so a pair keeps its key whatever batch it lands in.
+    """
+    h = hashlib.sha256()
+    for part in (model, template, repr(float(temperature)), str(int(max_tokens)),
+                 expected_error, student_error):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def fewshot_key(row):
+    """Key of a pair judged on its own with JUDGE_FEWSHOT_TEMPLATE, wherever that happens."""
+    return cache_key(DEFAULT_MODEL, JUDGE_FEWSHOT_TEMPLATE, 0.0, JUDGE_MAX_TOKENS,
+                     row["expected_error"], row["student_error"])
+
+
+class VerdictCache:
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, touch_flush=TOUCH_FLUSH):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.touch_flush = touch_flush
+        self._touched = {}  # key -> last_used not yet written
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # The parallel judge shares one cache across its worker threads
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            " key TEXT PRIMARY KEY,"
+            " model_output TEXT NOT NULL,"
+            " model_bool INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts(last_used)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def get(self, key):
+        """Return {"model_output", "model_bool"} for a cached verdict, else None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT model_output, model_bool FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_flush:
+                self._flush_touches()
+                self._conn.commit()
+        return {"model_output": row[0], "model_bool": bool(row[1])}
+
+    def put(self, key, model_output, model_bool):
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                (key, model_output, int(bool(model_bool)), now, now),
+            )
+            self._count += cur.rowcount
+            self._flush_touches()
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _flush_touches(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE verdicts SET last_used = ? WHERE key = ?",
+                [(t, k) for k, t in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self):
+        # Trim to 90% of the bound so we don't evict on every insert
+        target = int(self.max_entries * 0.9)
+        excess = self._count - target
+        self._conn.execute(
+            "DELETE FROM verdicts WHERE key IN ("
+            " SELECT key FROM verdicts ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._count -= excess
+        self.evictions += excess
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._count,
+            "evictions": self.evictions,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Cache hits/misses: {s['hits']}/{s['misses']} (hit rate {s['hit_rate']:.1%})")
+        print(f"Cache entries: {s['entries']} (evicted {s['evictions']})")
+
+    def close(self):
+        with self._lock:
+            self._flush_touches()
+            self._conn.commit()
+            self._conn.close()
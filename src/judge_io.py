@@ -0,0 +1,81 @@
+import json
+import threading
+from pathlib import Path
+
+
+def load_done_ids(path):
+    """
+    test_ids already present in a judgments file. A torn last line (crash in
+    the middle of a write) is cut off, and a complete last row missing its
+    newline gets one, so appending can continue cleanly.
+    """
+    path = Path(path)
+    done = set()
+    if not path.exists():
+        return done
+
+    good_end = 0
+    terminated = True
+    with path.open("rb") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["test_id"])
+            except (ValueError, KeyError):
+                break
+            good_end += len(line)
+            terminated = line.endswith(b"\n")
+    if good_end < path.stat().st_size or not terminated:
+        with path.open("r+b") as f:
+            f.truncate(good_end)
+            if not terminated:
+                f.seek(good_end)
+                f.write(b"\n")
+    return done
+
+
+class JudgmentWriter:
+    """
+    Appends judged rows to judgments.jsonl as soon as each verdict is known,
+    flushing after every job, so rows are in completion order, not input
+    order (sort by test_id if that matters). With resume=True, rows already
+    in the file are kept and skipped; otherwise the file starts empty.
+
+    Safe to share between the parallel judge's worker threads.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = Path(path)
+        self.done_ids = load_done_ids(self.path) if resume else set()
+        self.skipped = len(self.done_ids)
+        self.written = 0
+        self._lock = threading.Lock()
+        self._f = self.path.open("a" if resume else "w", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def pending_jobs(self, jobs, rows):
+        """Jobs with at least one row that isn't in the output yet."""
+        return [
+            job for job in jobs
+            if any(rows[i]["test_id"] not in self.done_ids for i in job["rows"])
+        ]
+
+    def write_job(self, job, verdict, rows):
+        """Fan one job's verdict out to its rows and append them."""
+        with self._lock:
+            for i in job["rows"]:
+                row = rows[i]
+                if row["test_id"] in self.done_ids:
+                    continue
+                self._f.write(json.dumps({**row, **verdict}, ensure_ascii=False) + "\n")
+                self.done_ids.add(row["test_id"])
+                self.written += 1
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            self._f.close()
@@ -0,0 +1,424 @@
+"""
+Long-lived local judge: keeps the model warm and grades pairs as they arrive.
+
+    python judge_service.py --port 8765
+    curl -s localhost:8765/judge -d '{"expected_error": "...", "student_error": "..."}'
+
+POST /judge takes one pair or a list of pairs and answers with the verdicts
+in the same order (a dict for a dict, a list for a list). Pairs arriving
+within --window of each other are judged together as one micro-batch: with
+--mode batch through BATCH_JUDGE_JSON_TEMPLATE (with the usual recovery),
+with --mode single as concurrent JUDGE_FEWSHOT_TEMPLATE calls. Verdicts go
+through the same on-disk cache as the scripts.
+
+GET /stats returns latency percentiles against the --slo-ms target, batch
+sizes and cache counters; GET /health says whether the model answered the
+last warmup.
+
+The judge scripts become thin clients of a running service with
+JUDGE_SERVICE=127.0.0.1:8765 (see judge_remote).
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+import requests
+from prompts import (BATCH_JUDGE_JSON_TEMPLATE, JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS,
+                     DEFAULT_MODEL, INFLIGHT, POOL, call_ollama, call_ollama_decision,
+                     normalize_bool)
+from judge_cache import VerdictCache, cache_key, fewshot_key
+from dedup import canonicalize
+from batch_recovery import judge_with_recovery
+from batch_json import SCHEMA_ITEM_TOKENS, call_batch_judge, answer_to_raw
+
+WARMUP_PROMPT = "You are a health check. Reply with True.\nANSWER:\n"
+
+# Ollama unloads an idle model after 5 minutes; ping it before that
+KEEPALIVE_SEC = 240
+
+# Latency samples kept for /stats percentiles
+STATS_WINDOW = 10_000
+
+# A client waiting longer than this gets a 504
+REQUEST_TIMEOUT_SEC = 300
+
+
+def judge_single(row):
+    prompt = JUDGE_FEWSHOT_TEMPLATE.format(
+        expected_error=row["expected_error"],
+        student_error=row["student_error"],
+    )
+    result = call_ollama_decision(prompt=prompt, temperature=0.0, max_tokens=JUDGE_MAX_TOKENS)
+    return result["model_output"]
+
+
+class MicroBatcher:
+    """
+    Collects submitted pairs into micro-batches: a batch closes `window`
+    seconds after its first pair arrived or when it holds `max_batch` pairs.
+    An idle service skips the window, so a lone request doesn't wait for
+    company. At most `workers` batches are judged at once; while they are
+    all busy, new arrivals keep joining the next batch, so batches grow
+    with load.
+    """
+
+    def __init__(self, mode="batch", window=0.02, max_batch=16, workers=2, cache=None):
+        self.mode = mode
+        self.window = window
+        self.max_batch = max_batch
+        self.cache = cache
+        self.template = BATCH_JUDGE_JSON_TEMPLATE if mode == "batch" else JUDGE_FEWSHOT_TEMPLATE
+        self.max_tokens = SCHEMA_ITEM_TOKENS if mode == "batch" else JUDGE_MAX_TOKENS
+        self.recovery = Counter()
+        self.batch_sizes = deque(maxlen=STATS_WINDOW)
+        self.last_call = time.time()
+
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(workers)
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._single_pool = ThreadPoolExecutor(max_workers=max_batch) if mode == "single" else None
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def submit(self, row):
+        fut = Future()
+        self._queue.put((row, fut, time.time()))
+        return fut
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0][2] + (self.window if self._busy else 0.0)
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._slots.acquire()
+            with self._busy_lock:
+                self._busy += 1
+            # Pairs that arrived while every worker was busy ride along
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            self._judge(batch)
+        except Exception as e:
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            with self._busy_lock:
+                self._busy -= 1
+            self._slots.release()
+
+    def _key(self, row):
+        return cache_key(DEFAULT_MODEL, self.template, 0.0, self.max_tokens,
+                         row["expected_error"], row["student_error"])
+
+    def _judge(self, batch):
+        t_start = time.time()
+        self.batch_sizes.append(len(batch))
+
+        # Cache hits answer at once; identical misses are judged once
+        groups = {}
+        for row, fut, t_enqueue in batch:
+            hit = self.cache.get(self._key(row)) if self.cache else None
+            if hit is not None:
+                fut.set_result({
+                    "model_output": hit["model_output"],
+                    "model_bool": hit["model_bool"],
+                    "cached": True,
+                    "queue_sec": t_start - t_enqueue,
+                    "latency_sec": time.time() - t_enqueue,
+                    "batch_size": len(batch),
+                })
+                continue
+            key = (canonicalize(row["expected_error"]), canonicalize(row["student_error"]))
+            groups.setdefault(key, []).append((row, fut, t_enqueue))
+        if not groups:
+            return
+
+        unique = [members[0][0] for members in groups.values()]
+        if self.mode == "batch":
+            via_single = []
+            answers = judge_with_recovery(unique, call_batch_judge, judge_single, self.recovery,
+                                          via_single)
+            raws = [answer_to_raw(ans) for ans in answers]
+        else:
+            raws = list(self._single_pool.map(judge_single, unique))
+            via_single = [True] * len(unique)
+        self.last_call = time.time()
+
+        for row, raw, single, members in zip(unique, raws, via_single, groups.values()):
+            model_bool = normalize_bool(raw)
+            if self.cache:
+                # A batch-mode fallback verdict came from the few-shot prompt
+                self.cache.put(fewshot_key(row) if single else self._key(row), raw, model_bool)
+            for _, fut, t_enqueue in members:
+                fut.set_result({
+                    "model_output": raw,
+                    "model_bool": model_bool,
+                    "cached": False,
+                    "queue_sec": t_start - t_enqueue,
+                    "latency_sec": time.time() - t_enqueue,
+                    "batch_size": len(batch),
+                })
+
+
+def _pct(sorted_vals, q):
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(int(len(sorted_vals) * q), len(sorted_vals) - 1)]
+
+
+class ServiceStats:
+    """Rolling per-pair latencies, checked against a p95 target."""
+
+    def __init__(self, slo_sec):
+        self.slo_sec = slo_sec
+        self.started = time.time()
+        self.requests = 0
+        self.pairs = 0
+        self.errors = 0
+        self._latency = deque(maxlen=STATS_WINDOW)
+        self._queue = deque(maxlen=STATS_WINDOW)
+        self._done_at = deque(maxlen=STATS_WINDOW)
+        self._lock = threading.Lock()
+
+    def record(self, verdicts):
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            self.pairs += len(verdicts)
+            for v in verdicts:
+                self._latency.append(v["latency_sec"])
+                self._queue.append(v["queue_sec"])
+                self._done_at.append(now)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            lat = sorted(self._latency)
+            qs = sorted(self._queue)
+            recent = [t for t in self._done_at if t > time.time() - 60]
+            snap = {
+                "uptime_sec": time.time() - self.started,
+                "requests": self.requests,
+                "pairs": self.pairs,
+                "errors": self.errors,
+                "pairs_per_sec_1m": len(recent) / 60.0,
+            }
+        def ms(v):
+            return v * 1000.0 if v is not None else None
+        p95 = _pct(lat, 0.95)
+        snap.update({
+            "p50_ms": ms(_pct(lat, 0.50)),
+            "p95_ms": ms(p95),
+            "p99_ms": ms(_pct(lat, 0.99)),
+            "queue_p95_ms": ms(_pct(qs, 0.95)),
+            "slo_p95_ms": self.slo_sec * 1000.0,
+            "slo_met": p95 is None or p95 <= self.slo_sec,
+            "within_slo": sum(1 for v in lat if v <= self.slo_sec) / len(lat) if lat else None,
+        })
+        return snap
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service = None
+
+    def log_message(self, *args):
+        if self.service["verbose"]:
+            super().log_message(*args)
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            batcher = self.service["batcher"]
+            cache = batcher.cache
+            sizes = list(batcher.batch_sizes)
+            stats = self.service["stats"].snapshot()
+            stats.update({
+                "mode": batcher.mode,
+                "batches": len(sizes),
+                "mean_batch_size": sum(sizes) / len(sizes) if sizes else None,
+                "recovery": dict(batcher.recovery),
+                "cache_hits": cache.hits if cache else 0,
+                "cache_misses": cache.misses if cache else 0,
+                "coalescing": INFLIGHT.stats(),
+                "endpoints": POOL.stats(),
+            })
+            self._send_json(200, stats)
+        elif self.path == "/health":
+            self._send_json(200 if self.service["warm"] else 503, {"warm": self.service["warm"]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/judge":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON body"})
+            return
+        rows = body if isinstance(body, list) else [body]
+        if not all(isinstance(r, dict) and isinstance(r.get("expected_error"), str)
+                   and isinstance(r.get("student_error"), str) for r in rows):
+            self._send_json(400, {"error": "each pair needs expected_error and student_error strings"})
+            return
+
+        stats = self.service["stats"]
+        futures = [self.service["batcher"].submit(r) for r in rows]
+        try:
+            verdicts = [f.result(timeout=REQUEST_TIMEOUT_SEC) for f in futures]
+        except Exception as e:
+            stats.record_error()
+            status = 504 if isinstance(e, TimeoutError) else 502
+            self._send_json(status, {"error": f"{type(e).__name__}: {e}"})
+            return
+        stats.record(verdicts)
+        self._send_json(200, verdicts if isinstance(body, list) else verdicts[0])
+
+
+def keep_warm(service):
+    """Warm the model now, then ping it whenever it has been idle for a while."""
+    batcher = service["batcher"]
+    while True:
+        if not service["warm"] or time.time() - batcher.last_call > KEEPALIVE_SEC:
+            t0 = time.time()
+            try:
+                call_ollama(prompt=WARMUP_PROMPT, temperature=0.0, max_tokens=4)
+                service["warm"] = True
+                if service["load_secs"] is None:
+                    service["load_secs"] = time.time() - t0
+                    print(f"model warm after {service['load_secs']:.3f}s")
+            except requests.RequestException as e:
+                service["warm"] = False
+                print(f"warmup failed: {e}")
+            batcher.last_call = time.time()
+        time.sleep(5)
+
+
+def service_url(host=None):
+    """Base URL of a running judge service, from JUDGE_SERVICE by default; None if unset."""
+    host = host or os.environ.get("JUDGE_SERVICE")
+    if not host:
+        return None
+    if "://" not in host:
+        host = "http://" + host
+    parts = urlsplit(host)
+    return f"{parts.scheme}://{parts.hostname}:{parts.port or 8765}"
+
+
+_session = threading.local()
+
+
+def judge_remote(rows, url):
+    """Verdicts for a list of pairs from the service at `url`, in order."""
+    session = getattr(_session, "s", None)
+    if session is None:
+        session = _session.s = requests.Session()
+    payload = [{"expected_error": r["expected_error"], "student_error": r["student_error"]}
+               for r in rows]
+    r = session.post(f"{url}/judge", json=payload, timeout=REQUEST_TIMEOUT_SEC)
+    r.raise_for_status()
+    return r.json()
+
+
+def remote_verdict(row, url):
+    """One pair through the service, with the fields the judge scripts write."""
+    v = judge_remote([row], url)[0]
+    return {
+        "model_output": v["model_output"],
+        "model_bool": v["model_bool"],
+        "cached": v["cached"],
+        "stop_reason": "cache" if v["cached"] else "service",
+        "queue_sec": v["queue_sec"],
+    }
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Persistent judge service with micro-batching.")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--mode", choices=["batch", "single"], default="batch",
+                   help="batch: one JSON batch prompt per micro-batch; single: concurrent few-shot calls")
+    p.add_argument("--window", type=float, default=0.02,
+                   help="seconds a micro-batch stays open after its first pair")
+    p.add_argument("--max-batch", type=int, default=16)
+    p.add_argument("--workers", type=int, default=2,
+                   help="micro-batches judged at once")
+    p.add_argument("--slo-ms", type=float, default=2000.0,
+                   help="p95 per-pair latency target reported by /stats")
+    p.add_argument("--no-cache", action="store_true")
+    p.add_argument("--verbose", action="store_true")
+    return p.parse_args(argv)
+
+
+class JudgeServer(ThreadingHTTPServer):
+    # Thin clients open one connection per worker thread
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cache = None if args.no_cache else VerdictCache()
+    service = {
+        "batcher": MicroBatcher(mode=args.mode, window=args.window, max_batch=args.max_batch,
+                                workers=args.workers, cache=cache),
+        "stats": ServiceStats(args.slo_ms / 1000.0),
+        "warm": False,
+        "load_secs": None,
+        "verbose": args.verbose,
+    }
+    threading.Thread(target=keep_warm, args=(service,), daemon=True).start()
+
+    handler = type("BoundHandler", (Handler,), {"service": service})
+    server = JudgeServer((args.host, args.port), handler)
+    print(f"judge service on http://{args.host}:{args.port} "
+          f"(mode {args.mode}, window {args.window * 1000:.0f}ms, max batch {args.max_batch})")
+    print(f"use it from the scripts with JUDGE_SERVICE={args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(service["stats"].snapshot(), indent=2))
+        if cache:
+            cache.print_stats()
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Rule-based pre-judge for templated compiler errors.
+
+Most gold messages follow a handful of templates ("Unexpected token PLUS
+(expected INT)", "Missing OPEN_BRA in If", "Identifier not found", ...).
+parse_error turns one into a structured ParsedError; prejudge compares a
+student message against it, either structurally (when the student
+compiler printed the same kind of template) or through TOKEN_SYNONYMS (when
+it wrote prose: '*' for MULT, "end of line" for EOL, ...). A pair gets a
+verdict only when the rules are unambiguous; anything else returns None and
+goes to the LLM.
+
+All patterns are compiled once at import, which takes a few milliseconds.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+from dedup import canonicalize
+
+ParsedError = namedtuple("ParsedError", "kind token expected context")
+
+# Token name -> how a student compiler may spell it in prose. Single
+# characters only count when quoted ('+'), words on word boundaries.
+TOKEN_SYNONYMS = {
+    "PLUS": ["+", "plus", "addition"],
+    "MINUS": ["-", "minus", "subtraction"],
+    "MULT": ["*", "mult", "multiplication", "asterisk"],
+    "DIV": ["/", "div", "division", "divide", "slash"],
+    "INT": ["int", "integer", "number", "numeral", "numeric", "digit"],
+    "IDEN": ["iden", "identifier"],
+    "EOL": ["eol", "end of line", "end of the line", "end-of-line"],
+    "NEWLINE": ["newline", "new line", "line break"],
+    "EOF": ["eof", "end of file", "end of the file", "end-of-file", "end of input",
+            "end of the input", "end of the program"],
+    "OPEN_PAR": ["(", "open_par", "opening parenthesis", "open parenthesis",
+                 "left parenthesis", "opening paren", "open paren"],
+    "CLOSE_PAR": [")", "close_par", "closing parenthesis", "close parenthesis",
+                  "right parenthesis", "closing paren", "close paren"],
+    "OPEN_BRA": ["{", "open_bra", "opening brace", "open brace", "left brace",
+                 "opening bracket", "open bracket", "opening curly"],
+    "CLOSE_BRA": ["}", "close_bra", "closing brace", "close brace", "right brace",
+                  "closing bracket", "close bracket", "closing curly"],
+    "ASSIGN": ["=", "assign", "assignment"],
+    "COLON": [":", "colon"],
+    "COMMA": [",", "comma"],
+    "ELSE": ["else"],
+    "FUNC": ["func"],
+}
+
+# Tokens that student compilers (and the few-shot examples) use for each
+# other in prose: mentioning one never contradicts the other
+COMPATIBLE = [{"EOL", "NEWLINE"}, {"OPEN_BRA", "OPEN_PAR"}, {"CLOSE_BRA", "CLOSE_PAR"}]
+
+# Symbols the gold templates write bare ("Invalid token ,")
+SYMBOL_TOKENS = {syns[0]: name for name, syns in TOKEN_SYNONYMS.items() if len(syns[0]) == 1}
+
+# Token names and bare symbols a template may name. Anything else ("missing
+# open parenthesis", "unexpected token 'x'") is prose, not a template.
+_TOKEN_ALT = "|".join(re.escape(t) for t in sorted(
+    [n.lower() for n in TOKEN_SYNONYMS] + list(SYMBOL_TOKENS), key=len, reverse=True))
+_MISSING_SUBJECTS = "right expression|second arg|function type|function main"
+
+_TEMPLATES = [
+    ("unexpected", re.compile(
+        rf"unexpected token (?P<token>{_TOKEN_ALT})(?: or (?:{_TOKEN_ALT}))?"
+        r"(?: \(expected (?P<expected>\S+)\)| (?P<context>(?:in|before) \w+))?")),
+    ("unexpected", re.compile(r"unexpected (?P<token>else|eof|identifier)")),
+    ("missing", re.compile(
+        rf"missing (?P<token>{_TOKEN_ALT}|{_MISSING_SUBJECTS})(?: (?P<context>in \w+))?")),
+    ("invalid", re.compile(rf"invalid token (?P<token>{_TOKEN_ALT}|[^\w\s])")),
+    # The course keeps "Incompatible Type" and "Incompatible Types" apart
+    ("type_mismatch", re.compile(r"incompatible (?P<token>types?)")),
+    ("not_found", re.compile(r"(?P<token>identifier|variable|function|type) not found")),
+    ("missing", re.compile(r"(?P<token>colon) not found")),
+    ("redeclared", re.compile(r"variable already declared")),
+    ("semantic", re.compile(r"(?P<token>number of args wrong|wrong arg type|"
+                            r"wrong func return type|invalid return in a void function)")),
+]
+
+_WORD_ALIASES = {"identifier": "IDEN"}
+
+
+def _synonym_pattern(syns):
+    parts = []
+    for s in syns:
+        if len(s) == 1:
+            parts.append(r"'" + re.escape(s) + r"'")
+        else:
+            parts.append(r"\b" + re.escape(s).replace(r"\ ", r"\s+") + r"\b")
+    return re.compile("|".join(parts))
+
+
+_TOKEN_RES = {name: _synonym_pattern(syns) for name, syns in TOKEN_SYNONYMS.items()}
+
+# Sentences that only give advice ("Did you forget ...?") may name other
+# tokens without contradicting the diagnosis
+_HINT_RE = re.compile(r"^(?:did you|make sure|remember|maybe|perhaps|check|hint|try|please)\b")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\s+-\s+")
+
+_NOT_FOUND_RE = re.compile(
+    r"not (?:been )?(?:defined|declared|found)|undefined|undeclared|"
+    r"(?:can't|cannot|could not|couldn't) (?:find|locate)|does(?: not|n't) exist|unknown")
+_TYPE_RE = re.compile(r"\btypes?\b|expected (?:an? )?(?:integer|int|string|number|bool)")
+# Type errors that are their own gold messages, not "Incompatible Type(s)"
+_OTHER_TYPE_RE = re.compile(r"\b(?:arg|args|argument|arguments|parameter|return)\b")
+_REDECLARED_RE = re.compile(r"already (?:been )?(?:declared|defined)|redeclar|duplicate")
+_MISSING_RE = re.compile(r"missing|forgot|forget|expected|expecting|need|add\b|without|not found")
+
+
+def _token_name(raw):
+    raw = raw.strip()
+    if raw in SYMBOL_TOKENS:
+        return SYMBOL_TOKENS[raw]
+    return _WORD_ALIASES.get(raw, raw).upper()
+
+
+@lru_cache(maxsize=4096)
+def parse_error(message):
+    """ParsedError for a templated message (whole message must match), else None."""
+    text = canonicalize(message)
+    for kind, pattern in _TEMPLATES:
+        m = pattern.fullmatch(text)
+        if m is None:
+            continue
+        groups = m.groupdict()
+        token = groups.get("token")
+        expected = groups.get("expected")
+        return ParsedError(
+            kind,
+            _token_name(token) if token else None,
+            _token_name(expected) if expected else None,
+            groups.get("context"),
+        )
+    return None
+
+
+def compatible(a, b):
+    return a == b or any(a in group and b in group for group in COMPATIBLE)
+
+
+def same_error(a, b):
+    """
+    Whether two parsed templates describe the same error: True when every
+    field matches, False when a field both sides fill in differs ("Missing
+    OPEN_PAR in If" vs "Missing OPEN_PAR in While"), None when one side only
+    leaves out a detail the other gives ("Unexpected token PLUS" vs
+    "Unexpected token PLUS (expected INT)"), which a grader may or may not
+    accept.
+    """
+    if a == b:
+        return True
+    if a.kind != b.kind or a.token != b.token:
+        return False
+    for x, y in ((a.expected, b.expected), (a.context, b.context)):
+        if x is not None and y is not None and x != y:
+            return False
+    return None
+
+
+def mentioned_tokens(text):
+    return {name for name, pattern in _TOKEN_RES.items() if pattern.search(text)}
+
+
+def _prose_verdict(gold, text):
+    sentences = [s for s in _SENTENCE_RE.split(text) if s]
+    main = " ".join(s for s in sentences if not _HINT_RE.match(s))
+    anywhere = mentioned_tokens(text)
+    in_main = mentioned_tokens(main)
+
+    if gold.kind in ("unexpected", "missing", "invalid") and gold.token in TOKEN_SYNONYMS:
+        wanted = {gold.token} | ({gold.expected} if gold.expected else set())
+        others = {t for t in in_main if not any(compatible(t, w) for w in wanted)}
+        if gold.kind == "missing" and not _MISSING_RE.search(text):
+            return None, "missing-cue"
+        if gold.token in anywhere and not others:
+            return True, "token-match"
+        # Naming a different token is not enough for False: student
+        # compilers report the same fault loosely ("end of file" for EOL,
+        # "closing bracket" for EOF), so those go to the LLM
+        return None, "token-ambiguous"
+
+    if gold.kind == "type_mismatch":
+        if _TYPE_RE.search(main) and not _NOT_FOUND_RE.search(main) \
+                and not _OTHER_TYPE_RE.search(main):
+            return True, "type-cue"
+        return None, "type-ambiguous"
+
+    if gold.kind == "not_found":
+        subject = {"IDEN": ("variable", "identifier"), "VARIABLE": ("variable", "identifier"),
+                   "FUNCTION": ("function",), "TYPE": ("type",)}[gold.token]
+        if _NOT_FOUND_RE.search(main) and any(re.search(rf"\b{w}", main) for w in subject):
+            others = {"variable", "identifier", "function", "type"} - set(subject)
+            if not any(re.search(rf"\b{w}\b", main) for w in others):
+                return True, "not-found-cue"
+        return None, "not-found-ambiguous"
+
+    if gold.kind == "redeclared":
+        if _REDECLARED_RE.search(main):
+            return True, "redeclared-cue"
+        return None, "redeclared-ambiguous"
+
+    return None, "no-rule"
+
+
+def prejudge(expected_error, student_error):
+    """
+    (verdict, rule): verdict is True/False when the rules settle the pair,
+    None when it should go to the LLM; rule names the rule that fired.
+    """
+    gold = parse_error(expected_error)
+    if gold is None:
+        return None, "gold-unparsed"
+    student = parse_error(student_error)
+    if student is not None:
+        verdict = same_error(gold, student)
+        return verdict, "template" if verdict is not None else "template-partial"
+    return _prose_verdict(gold, canonicalize(student_error))
+
+
+# Pairs whose verdict must not change; `python lexicon.py` checks them.
+# None means the pair must go to the LLM.
+REGRESSION_PAIRS = [
+    ("Missing OPEN_PAR", "missing open parenthesis", True),
+    ("Missing OPEN_BRA", "Missing opening brace", True),
+    ("Unexpected token PLUS", "Unexpected token '+'", True),
+    ("Missing OPEN_PAR", "student compiler: Missing OPEN_PAR in If", None),
+    ("Missing OPEN_PAR in If", "student compiler: Missing OPEN_PAR in If", True),
+    ("Missing OPEN_PAR in If", "student compiler: Missing OPEN_PAR in While", False),
+    ("Unexpected token PLUS (expected INT)", "student compiler: Unexpected token PLUS", None),
+    ("Unexpected token PLUS (expected INT)", "Unexpected token PLUS (expected IDEN)", False),
+    ("Unexpected token EOL", "Unexpected end of file", None),
+    ("Incompatible Type", "student compiler: Incompatible Types", False),
+    ("Invalid token ,", "Line 3: unexpected ',' here", True),
+]
+
+
+if __name__ == "__main__":
+    failed = 0
+    for expected, student, want in REGRESSION_PAIRS:
+        got, rule = prejudge(expected, student)
+        if got is not want:
+            failed += 1
+            print(f"FAIL {expected!r} vs {student!r}: got {got} ({rule}), want {want}")
+    print(f"{len(REGRESSION_PAIRS) - failed} of {len(REGRESSION_PAIRS)} regression pairs ok")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,44 @@
+"""
+The LLM stage of the two-stage judges (2_judge_pairs_cascade.py and
+2_judge_pairs_lexicon.py): the pairs their first stage can't settle go
+through the few-shot judge here, one call per pair.
+"""
+import time
+from prompts import JUDGE_FEWSHOT_TEMPLATE, JUDGE_MAX_TOKENS, POOL, call_ollama_decision
+from judge_cache import fewshot_key
+
+# Worker threads per Ollama server in OLLAMA_HOST
+WORKERS_PER_SERVER = 16
+
+
+def llm_workers():
+    """Thread pool size for the LLM stage: WORKERS_PER_SERVER for each server in POOL."""
+    return WORKERS_PER_SERVER * len(POOL)
+
+
+def judge_llm(row, cache, t_submit):
+    """(model_output, model_bool, cached, latency_sec, timing) for one pair; timing is None on a hit."""
+    key = fewshot_key(row)
+
+    t0 = time.time()
+    hit = cache.get(key)
+    if hit is not None:
+        raw, model_bool = hit["model_output"], hit["model_bool"]
+        timing = None
+    else:
+        prompt = JUDGE_FEWSHOT_TEMPLATE.format(
+            expected_error=row["expected_error"],
+            student_error=row["student_error"],
+        )
+        result = call_ollama_decision(
+            prompt=prompt,
+            temperature=0.0,
+            max_tokens=JUDGE_MAX_TOKENS,
+        )
+        raw, model_bool = result["model_output"], result["model_bool"]
+        timing = result["timing"]
+        timing["queue_sec"] = t0 - t_submit  # waiting for a pool thread
+        cache.put(key, raw, model_bool)
+    t1 = time.time()
+
+    return raw, model_bool, hit is not None, t1 - t0, timing
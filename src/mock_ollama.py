@@ -0,0 +1,344 @@
+"""
+Stand-in for an Ollama server, for measuring the Python side without a GPU.
+
+Speaks the parts of the API the scripts use: streaming (NDJSON) and
+non-streaming POST /api/generate, including `format` JSON schemas and
+`num_predict`, plus GET /api/tags. Answers are deterministic functions of
+the prompt (and seed), so runs are comparable; timing, errors, a slow
+tail (--straggler-rate) and the concurrency limit are configurable.
+
+    python mock_ollama.py --port 11435 --ttft 0.05 --tok-per-sec 80 --parallel 4
+    OLLAMA_HOST=127.0.0.1:11435 python 2_judge_pairs_parallel.py
+
+GET /mock/stats returns request counters as JSON.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from prompts import DEFAULT_MODEL
+
+TOKEN_RE = re.compile(r"\S+|\s+")
+WORD_RE = re.compile(r"[a-z0-9_]+")
+PAIR_RE = re.compile(r"^Pair (\d+):\nEXPECTED_ERROR:\n(.*?)\n\nSTUDENT_ERROR:\n(.*?)\n", re.M | re.S)
+SINGLE_RE = re.compile(r'^\s*"(.*)"\s*STUDENT_ERROR:\s*"(.*)"\s*ANSWER:', re.S)
+OFFICIAL_RE = re.compile(r'OFFICIAL ERROR:\n"(.*)"\n', re.S)
+
+# Words that carry no signal when comparing two error messages
+STOPWORDS = {"error", "line", "student", "compiler", "the", "a", "an", "at", "in",
+             "of", "but", "was", "found", "expected", "got", "unexpected", "token"}
+
+
+def prompt_hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return int.from_bytes(h.digest()[:8], "big")
+
+
+def mock_verdict(expected, student):
+    """
+    Cheap stand-in for the judge: True when the messages share a content
+    word. Crude, but deterministic and right often enough that accuracy
+    numbers from a mock run aren't meaningless.
+    """
+    a = set(WORD_RE.findall(expected.lower())) - STOPWORDS
+    b = set(WORD_RE.findall(student.lower())) - STOPWORDS
+    return bool(a & b) if a else prompt_hash(expected, student) % 2 == 0
+
+
+def mock_paraphrase(expected, k, h):
+    templates = [
+        "Line {n}: error: {msg}",
+        "error at line {n}: {msg}",
+        "[line {n}] {msg}",
+        "Compile error ({n}): {msg}",
+    ]
+    return templates[(h + k) % len(templates)].format(n=(h >> 8) % 40 + 1 + k, msg=expected.lower())
+
+
+def value_for_schema(schema, h, path=""):
+    """Deterministic instance of the (small) JSON-schema subset the scripts send."""
+    if "const" in schema:
+        return schema["const"]
+    kind = schema.get("type")
+    if kind == "array":
+        # Same precedence as llama.cpp's schema-to-grammar (used by Ollama):
+        # `items` wins over `prefixItems`; a list is a fixed tuple, a
+        # non-schema (false) allows no elements at all
+        items = schema.get("items", schema.get("prefixItems"))
+        if isinstance(items, list):
+            return [value_for_schema(s, h, f"{path}/{i}") for i, s in enumerate(items)]
+        if not isinstance(items, dict):
+            return [] if items is False else [value_for_schema({"type": "string"}, h, f"{path}/0")]
+        n = schema.get("minItems", 1)
+        return [value_for_schema(items, h, f"{path}/{i}") for i in range(n)]
+    if kind == "object":
+        return {k: value_for_schema(v, h, f"{path}/{k}")
+                for k, v in schema.get("properties", {}).items()}
+    if kind == "boolean":
+        return prompt_hash(h, path) % 2 == 0
+    if kind in ("integer", "number"):
+        return schema.get("minimum", 0) + prompt_hash(h, path) % 10
+    return f"mock-{prompt_hash(h, path) % 100_000}"
+
+
+def mock_response(prompt, fmt, seed):
+    """Text the mock 'model' generates for one request."""
+    h = prompt_hash(prompt, seed)
+    pairs = PAIR_RE.findall(prompt)
+    official = OFFICIAL_RE.search(prompt)
+
+    if pairs:
+        verdicts = [(int(i), mock_verdict(e, s)) for i, e, s in pairs]
+        if fmt is not None or "JSON" in prompt:
+            return json.dumps([{"index": i, "correct": v} for i, v in verdicts])
+        return "\n".join(f"{i}: {v}" for i, v in verdicts)
+
+    if official:
+        expected = official.group(1)
+        if isinstance(fmt, dict) and fmt.get("type") == "array":
+            k = fmt.get("minItems", 1)
+            return json.dumps([mock_paraphrase(expected, j, h) for j in range(k)])
+        return mock_paraphrase(expected, 0, h)
+
+    if isinstance(fmt, dict):
+        return json.dumps(value_for_schema(fmt, h))
+    if fmt == "json":
+        return json.dumps({"answer": h % 2 == 0})
+
+    # Single-pair judge: the pair to judge comes after the few-shot examples
+    m = SINGLE_RE.match(prompt.rsplit("EXPECTED_ERROR:", 1)[-1])
+    if m:
+        verdict = mock_verdict(m.group(1), m.group(2))
+    else:
+        verdict = h % 2 == 0
+    return f"{verdict}\n\n# Reason: mock verdict from word overlap."
+
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.slots = threading.Semaphore(args.parallel)
+        self.lock = threading.Lock()
+        self.rng = random.Random(args.seed)
+        self.waiting = 0
+        self.in_flight = 0
+        self.stats = {"requests": 0, "errors": 0, "rejected": 0,
+                      "disconnects": 0, "peak_in_flight": 0, "peak_queue": 0}
+
+    def should_fail(self):
+        with self.lock:
+            return self.rng.random() < self.args.error_rate
+
+    def straggle(self):
+        """Extra delay for this request: a slow tail like a GC pause or a busy GPU."""
+        with self.lock:
+            return self.args.straggler_delay if self.rng.random() < self.args.straggler_rate else 0.0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, *args):
+        if self.state.args.verbose:
+            super().log_message(*args)
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": self.state.args.model,
+                                              "model": self.state.args.model}]})
+        elif self.path == "/mock/stats":
+            with self.state.lock:
+                self._send_json(200, dict(self.state.stats))
+        elif self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            req = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON body"})
+            return
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        st = self.state
+        args = st.args
+        with st.lock:
+            st.stats["requests"] += 1
+            if args.max_queue >= 0 and st.waiting >= args.max_queue and st.in_flight >= args.parallel:
+                st.stats["rejected"] += 1
+                reject = True
+            else:
+                reject = False
+                st.waiting += 1
+                st.stats["peak_queue"] = max(st.stats["peak_queue"], st.waiting)
+        if reject:
+            # Same status real Ollama uses when its request queue is full
+            self._send_json(503, {"error": "server busy, please try again. maximum pending requests exceeded"})
+            return
+
+        t_arrive = time.time()
+        with st.slots:
+            with st.lock:
+                st.waiting -= 1
+                st.in_flight += 1
+                st.stats["peak_in_flight"] = max(st.stats["peak_in_flight"], st.in_flight)
+            try:
+                self._generate(req, t_arrive)
+            finally:
+                with st.lock:
+                    st.in_flight -= 1
+
+    def _generate(self, req, t_arrive):
+        st = self.state
+        args = st.args
+        if st.should_fail():
+            with st.lock:
+                st.stats["errors"] += 1
+            self._send_json(500, {"error": "mock: injected failure"})
+            return
+
+        prompt = req.get("prompt", "")
+        options = req.get("options") or {}
+        model = req.get("model", args.model)
+        num_predict = options.get("num_predict", -1)
+
+        text = mock_response(prompt, req.get("format"), options.get("seed"))
+        tokens = TOKEN_RE.findall(text)
+        done_reason = "stop"
+        if num_predict is not None and 0 <= num_predict < len(tokens):
+            tokens = tokens[:num_predict]
+            done_reason = "length"
+
+        prompt_tokens = len(prompt) // 4 + 1
+        time.sleep(args.latency + st.straggle())  # prompt evaluation
+        t_prompt = time.time()
+        time.sleep(args.ttft)
+        per_token = 1.0 / args.tok_per_sec if args.tok_per_sec > 0 else 0.0
+
+        def final(t_end):
+            return {
+                "model": model,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "response": "",
+                "done": True,
+                "done_reason": done_reason,
+                "total_duration": int((t_end - t_arrive) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int((t_prompt - t_arrive) * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int((t_end - t_prompt) * 1e9),
+            }
+
+        if req.get("stream", True) is False:
+            time.sleep(per_token * len(tokens))
+            out = final(time.time())
+            out["response"] = "".join(tokens)
+            self._send_json(200, out)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(obj):
+            data = (json.dumps(obj) + "\n").encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        try:
+            for i, tok in enumerate(tokens):
+                if i:
+                    time.sleep(per_token)
+                chunk({"model": model, "response": tok, "done": False})
+            chunk(final(time.time()))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client hung up early (decision mode does this on purpose)
+            with st.lock:
+                st.stats["disconnects"] += 1
+            self.close_connection = True
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Deterministic stand-in for the Ollama API.")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=11435)
+    p.add_argument("--model", default=DEFAULT_MODEL)
+    p.add_argument("--latency", type=float, default=0.02,
+                   help="prompt-evaluation delay per request (s)")
+    p.add_argument("--ttft", type=float, default=0.03,
+                   help="extra delay before the first token (s)")
+    p.add_argument("--tok-per-sec", type=float, default=100.0,
+                   help="generation speed after the first token (0 = instant)")
+    p.add_argument("--error-rate", type=float, default=0.0,
+                   help="fraction of requests answered with HTTP 500")
+    p.add_argument("--straggler-rate", type=float, default=0.0,
+                   help="fraction of requests delayed by --straggler-delay")
+    p.add_argument("--straggler-delay", type=float, default=1.0,
+                   help="extra prompt-evaluation delay of a straggler (s)")
+    p.add_argument("--parallel", type=int, default=4,
+                   help="requests generated at once, like OLLAMA_NUM_PARALLEL")
+    p.add_argument("--max-queue", type=int, default=512,
+                   help="requests allowed to wait for a slot before 503s (-1 = unbounded)")
+    p.add_argument("--seed", type=int, default=0, help="seed for injected errors and stragglers")
+    p.add_argument("--verbose", action="store_true")
+    return p.parse_args(argv)
+
+
+class MockServer(ThreadingHTTPServer):
+    # Concurrency tests open hundreds of connections at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_server(args):
+    handler = type("BoundHandler", (Handler,), {"state": MockState(args)})
+    return MockServer((args.host, args.port), handler)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = make_server(args)
+    print(f"mock Ollama on http://{args.host}:{args.port} "
+          f"(parallel {args.parallel}, ttft {args.ttft}s, {args.tok_per_sec} tok/s, "
+          f"error rate {args.error_rate})")
+    print(f"use it with OLLAMA_HOST={args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import time
+from prompts import (DEFAULT_MODEL, POOL, SERVER_RETRIES, SERVER_RETRY_PAUSE_SECS,
+                     decide_bool, normalize_bool)
+from telemetry import CallTimer, read_to_done
+
+# Once decide mode has its verdict, a call with max_tokens at most this
+# reads on to the end so its keep-alive connection can be reused (a few
+# tokens cost less than a new connection); a longer one hangs up so the
+# server stops generating.
+DRAIN_MAX_TOKENS = 16
+
+class OllamaHTTPError(RuntimeError):
+    def __init__(self, status, detail):
+        super().__init__(f"HTTP {status}: {detail}")
+        self.status = status
+
+
+class AsyncOllamaClient:
+    """
+    asyncio counterpart of prompts.call_ollama.
+
+    Speaks just enough HTTP/1.1 to stream /api/generate over keep-alive
+    connections. Finished connections go back to an idle pool (one per
+    endpoint), so a run pays TCP setup once per connection rather than once
+    per pair. It does not limit concurrency: the caller bounds the
+    requests in flight (and therefore open connections), e.g. with a
+    semaphore outside hedging.hedged so backups don't queue behind it. Each
+    request goes to the endpoint `pool` picks (prompts.POOL by default, see
+    endpoints.EndpointPool).
+    """
+
+    def __init__(self, pool=POOL):
+        self.pool = pool
+        self._idle = {}
+        self.connections_opened = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        idle = [conn for conns in self._idle.values() for conn in conns]
+        self._idle = {}
+        for _, writer in idle:
+            writer.close()
+        for _, writer in idle:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _get_conn(self, ep):
+        idle = self._idle.setdefault(ep, [])
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        self.connections_opened += 1
+        reader, writer = await asyncio.open_connection(ep.host, ep.port)
+        return reader, writer, False
+
+    def _put_conn(self, ep, conn):
+        self._idle.setdefault(ep, []).append(conn)
+
+    async def _read_headers(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed before response")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+
+    async def _iter_body(self, reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b";")[0], 16)
+                if size == 0:
+                    # trailer section ends with an empty line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                chunk = await reader.readexactly(size)
+                await reader.readexactly(2)
+                yield chunk
+        elif "content-length" in headers:
+            yield await reader.readexactly(int(headers["content-length"]))
+        else:
+            yield await reader.read()
+
+    async def generate(self, prompt, model=DEFAULT_MODEL, temperature=0.0, max_tokens=32,
+                       decide=False, route=None):
+        """
+        Returns the generated text. With decide=True behaves like
+        prompts.call_ollama_decision: the verdict is the first tokens that
+        settle it (the rest of a short stream is drained, see
+        DRAIN_MAX_TOKENS, a longer one is hung up on) and it returns {"model_output", "model_bool", "stop_reason", "timing"}.
+
+        `route` (a list) avoids the endpoints already in it and gets the one
+        used appended; hedging.hedged uses it to send a backup elsewhere.
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens
+            },
+            "stream": True
+        }
+        body = json.dumps(payload).encode("utf-8")
+
+        timer = CallTimer()
+        # Same retry policy as prompts._stream_ollama
+        tried = []
+        rounds = 0
+        last_error = None
+        while True:
+            if len(tried) >= len(self.pool):
+                if rounds == SERVER_RETRIES:
+                    raise last_error
+                rounds += 1
+                tried = []
+                await asyncio.sleep(SERVER_RETRY_PAUSE_SECS * rounds)
+            ep = self.pool.acquire(exclude=[*(route or ()), *tried])
+            if route is not None:
+                route.append(ep)
+            request = (
+                f"POST {ep.path} HTTP/1.1\r\n"
+                f"Host: {ep.host}:{ep.port}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: keep-alive\r\n"
+                "\r\n"
+            ).encode("latin-1") + body
+            t0 = time.time()
+            writer = None
+            outcome = "failed"
+            try:
+                try:
+                    reader, writer, reused = await self._get_conn(ep)
+                except OSError as e:
+                    # Refused or unreachable: try the next endpoint
+                    tried.append(ep)
+                    last_error = e
+                    continue
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, headers = await self._read_headers(reader)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    writer.close()
+                    # The server may have dropped an idle keep-alive
+                    # connection; retry on another one.
+                    if reused:
+                        outcome = "stale"
+                        continue
+                    tried.append(ep)
+                    last_error = e
+                    continue
+                try:
+                    result = await self._read_response(ep, reader, writer, status, headers,
+                                                       decide, max_tokens, timer)
+                except OllamaHTTPError as e:
+                    if e.status < 500:
+                        # A bad request (unknown model, bad payload) fails on
+                        # every server and says nothing about this one
+                        outcome = "rejected"
+                        raise
+                    # Server error: count it and try the next endpoint
+                    tried.append(ep)
+                    last_error = e
+                    continue
+                outcome = "ok"
+                return result
+            except asyncio.CancelledError:
+                # Hedged away (or shutting down): drop the connection so
+                # the server stops generating; not the endpoint's fault
+                if writer is not None:
+                    writer.close()
+                outcome = "cancelled"
+                raise
+            finally:
+                if outcome == "ok":
+                    self.pool.release(ep, time.time() - t0)
+                elif outcome in ("stale", "cancelled", "rejected"):
+                    self.pool.release(ep)
+                else:
+                    self.pool.release(ep, time.time() - t0, ok=False)
+
+    async def _read_response(self, ep, reader, writer, status, headers, decide, max_tokens,
+                             timer):
+        reusable = False
+        try:
+            if status != 200:
+                detail = b"".join([c async for c in self._iter_body(reader, headers)])
+                raise OllamaHTTPError(status, detail.decode("utf-8", "replace"))
+
+            full = []
+            verdict = None
+            stop_reason = "eof"
+            # Like prompts._decision_call: a sampled call reads on to `done`
+            # for its timing, keeping the output that decided it. So does one
+            # with little budget left, to keep its connection.
+            full_read = decide and (max_tokens <= DRAIN_MAX_TOKENS or read_to_done())
+            buf = b""
+            async for chunk in self._iter_body(reader, headers):
+                buf += chunk
+                *lines, buf = buf.split(b"\n")
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    data = json.loads(line.decode("utf-8"))
+                    timer.on_message(data)
+                    if "response" in data and verdict is None:
+                        full.append(data["response"])
+                        if decide:
+                            verdict = decide_bool("".join(full))
+                            if verdict is not None:
+                                stop_reason = "decided"
+                    if data.get("done", False) and verdict is None:
+                        stop_reason = data.get("done_reason", "stop")
+                if verdict is not None and not full_read:
+                    # Hang up mid-stream; the connection can't be reused
+                    break
+            else:
+                if buf.strip():
+                    data = json.loads(buf.decode("utf-8"))
+                    timer.on_message(data)
+                    if verdict is None:
+                        full.append(data.get("response", ""))
+                # Only reuse connections whose response was read to the end
+                reusable = headers.get("connection", "").lower() != "close"
+
+            raw = "".join(full).strip()
+            if not decide:
+                return raw
+            if verdict is None:
+                verdict = normalize_bool(raw)
+            return {"model_output": raw, "model_bool": verdict, "stop_reason": stop_reason,
+                    "timing": timer.timing()}
+        finally:
+            if reusable:
+                self._put_conn(ep, (reader, writer))
+            else:
+                writer.close()
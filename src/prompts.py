@@ -1,21 +1,79 @@
+import os
+import time
 import requests
 import json
-
-GEN_PROMPT_TEMPLATE = """You are helping generate plausible compiler error messages written by student compilers.
-
-You will be given the official compiler error message for a program. Write an alternative error message that:
-- Describes the SAME root cause in your own natural wording.
+from urllib.parse import urlsplit
+from telemetry import CallTimer, read_to_done
+from singleflight import SingleFlight, call_key
+from endpoints import EndpointPool
+
+DEFAULT_MODEL = "qwen2.5:3b-instruct"
+
+
+def ollama_url(host=None):
+    """
+    /api/generate URL for an Ollama-compatible server. `host` follows the
+    OLLAMA_HOST convention ("127.0.0.1:11435", "http://box:11434", ...);
+    by default it is read from that environment variable.
+    """
+    host = host or os.environ.get("OLLAMA_HOST") or "localhost:11434"
+    if "://" not in host:
+        host = "http://" + host
+    parts = urlsplit(host)
+    port = parts.port or 11434
+    return f"{parts.scheme}://{parts.hostname}:{port}/api/generate"
+
+
+def ollama_urls(hosts=None):
+    """One /api/generate URL per server in a comma-separated OLLAMA_HOST list."""
+    hosts = hosts or os.environ.get("OLLAMA_HOST") or "localhost:11434"
+    return [ollama_url(h.strip()) for h in hosts.split(",") if h.strip()]
+
+
+# Point every script at another server (e.g. mock_ollama.py) with
+# OLLAMA_HOST=127.0.0.1:11435, or at several with
+# OLLAMA_HOST=127.0.0.1:11434,127.0.0.1:11435: requests are then spread
+# over them by POOL (see endpoints.EndpointPool)
+OLLAMA_URLS = ollama_urls()
+OLLAMA_URL = OLLAMA_URLS[0]
+POOL = EndpointPool(OLLAMA_URLS)
+
+# When a request has failed on every endpoint (connection error or 5xx), the
+# whole pool is tried again this many times, pausing a little longer each
+# round, before the error is raised. With one server this is a plain retry.
+SERVER_RETRIES = 2
+SERVER_RETRY_PAUSE_SECS = 0.5
+
+# Identical requests that are in flight at the same moment (same model,
+# prompt and options) share one Ollama call; see INFLIGHT.print_stats()
+COALESCE = True
+INFLIGHT = SingleFlight()
+
+
+def _coalesced(key, fn):
+    """fn() through INFLIGHT. Each caller gets its own copy of the result dict."""
+    if not COALESCE:
+        return fn()
+    result, _ = INFLIGHT.do(key, fn)
+    return {**result, "timing": dict(result["timing"])}
+
+GEN_MULTI_PROMPT_TEMPLATE = """You are helping generate plausible compiler error messages written by student compilers.
+
+You will be given the official compiler error message for a program. Write {k} different alternative error messages. Each one must:
+- Describe the SAME root cause in its own natural wording.
 - May simplify terms, reorder phrases, or add hints like line numbers, variable names, etc.
-- Looks like it was printed by a student-built compiler (so it's okay if it's a bit rough or inconsistent).
-- Must NOT claim to be an official or reference compiler.
-- Must NOT copy the exact text verbatim.
+- Look like it was printed by a student-built compiler (so it's okay if it's a bit rough or inconsistent).
+- NOT claim to be an official or reference compiler.
+- NOT copy the exact text verbatim.
+
+Make the {k} messages differ from each other, as if printed by {k} different students' compilers.
 
-Return ONLY the student's error message, nothing else.
+Return ONLY a JSON array of {k} strings, nothing else.
 
 OFFICIAL ERROR:
 "{expected_error}"
 
-STUDENT COMPILER MESSAGE:
+STUDENT COMPILER MESSAGES:
 """
 
 BATCH_JUDGE_JSON_TEMPLATE = """You are an automatic grader for a compiler course.
@@ -180,6 +238,9 @@ STUDENT_ERROR:
 ANSWER:
 """
 
+# Generation cap for one JUDGE_FEWSHOT_TEMPLATE verdict (part of its cache key)
+JUDGE_MAX_TOKENS = 8
+
 BATCH_JUDGE_TEMPLATE = """You are an automatic grader for a compiler course.
 
 Task:
@@ -213,11 +274,12 @@ Here are the pairs:
 ANSWERS:
 """
 
-def call_ollama(prompt: str,
-                model: str = "qwen2.5:3b-instruct",
-                temperature: float = 0.0,
-                max_tokens: int = 32) -> str:
-    url = "http://localhost:11434/api/generate"
+def _stream_ollama(prompt, model, temperature, max_tokens, format_schema=None, seed=None):
+    """
+    Yield the decoded NDJSON messages of one streaming /api/generate call.
+    `format_schema` is passed as Ollama's `format` field ("json" or a JSON
+    schema) to constrain decoding; `seed` makes sampling reproducible.
+    """
     payload = {
         "model": model,
         "prompt": prompt,
@@ -227,19 +289,157 @@ def call_ollama(prompt: str,
         },
         "stream": True
     }
-    with requests.post(url, json=payload, stream=True) as r:
-        r.raise_for_status()
+    if format_schema is not None:
+        payload["format"] = format_schema
+    if seed is not None:
+        payload["options"]["seed"] = seed
+    # A request that can't even start (connection refused, 5xx) counts
+    # against the endpoint and is retried on the next one; once every one has
+    # failed, on the whole pool again, up to SERVER_RETRIES rounds. A 4xx
+    # (unknown model, bad payload) would fail on every server and isn't this
+    # one's fault: it is raised straight away.
+    tried = []
+    rounds = 0
+    last_error = None
+    while True:
+        if len(tried) >= len(POOL):
+            if rounds == SERVER_RETRIES:
+                raise last_error
+            rounds += 1
+            tried = []
+            time.sleep(SERVER_RETRY_PAUSE_SECS * rounds)
+        ep = POOL.acquire(exclude=tried)
+        t0 = time.time()
+        try:
+            r = requests.post(ep.url, json=payload, stream=True)
+        except requests.RequestException as e:
+            POOL.release(ep, time.time() - t0, ok=False)
+            tried.append(ep)
+            last_error = e
+            continue
+        if r.status_code >= 400:
+            error = requests.HTTPError(
+                f"HTTP {r.status_code} from {ep.base}: {r.text[:500]}", response=r)
+            r.close()
+            if r.status_code < 500:
+                POOL.release(ep)
+                raise error
+            POOL.release(ep, time.time() - t0, ok=False)
+            tried.append(ep)
+            last_error = error
+            continue
+        break
+
+    # Closing this generator early closes the response, which drops the
+    # connection and lets Ollama cancel the rest of the generation.
+    ok = False
+    try:
+        with r:
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line.decode("utf-8"))
+                yield data
+                if data.get("done", False):
+                    break
+        ok = True
+    except GeneratorExit:
+        ok = True  # the caller hung up on purpose
+        raise
+    finally:
+        POOL.release(ep, time.time() - t0, ok)
+
+def call_ollama_timed(prompt: str,
+                      model: str = DEFAULT_MODEL,
+                      temperature: float = 0.0,
+                      max_tokens: int = 32,
+                      format_schema=None,
+                      seed: int = None) -> dict:
+    """call_ollama plus per-call timing (see telemetry.CallTimer): {"text", "timing"}."""
+    def call():
         full = []
-        for line in r.iter_lines():
-            if not line:
-                continue
-            data = json.loads(line.decode("utf-8"))
+        timer = CallTimer()
+        for data in _stream_ollama(prompt, model, temperature, max_tokens, format_schema, seed):
+            timer.on_message(data)
             if "response" in data:
                 full.append(data["response"])
-            if data.get("done", False):
-                break
-        return "".join(full).strip()
+        return {"text": "".join(full).strip(), "timing": timer.timing()}
+
+    key = call_key("generate", model, prompt, temperature=temperature, max_tokens=max_tokens,
+                   format_schema=format_schema, seed=seed)
+    return _coalesced(key, call)
+
+def call_ollama(prompt: str,
+                model: str = DEFAULT_MODEL,
+                temperature: float = 0.0,
+                max_tokens: int = 32,
+                format_schema=None,
+                seed: int = None) -> str:
+    return call_ollama_timed(prompt, model, temperature, max_tokens, format_schema, seed)["text"]
+
+def call_ollama_decision(prompt: str,
+                         model: str = DEFAULT_MODEL,
+                         temperature: float = 0.0,
+                         max_tokens: int = 8) -> dict:
+    """
+    Single-pair judge call that stops reading as soon as the answer is known.
+
+    Returns the raw prefix read so far, the verdict, why we stopped:
+    "decided" (we hung up early), or Ollama's own done_reason ("stop",
+    "length") if the stream finished before the answer was clear, and the
+    call's timing.
+    """
+    key = call_key("decision", model, prompt, temperature=temperature, max_tokens=max_tokens)
+    return _coalesced(key, lambda: _decision_call(prompt, model, temperature, max_tokens))
+
+def _decision_call(prompt, model, temperature, max_tokens):
+    full = []
+    verdict = None
+    stop_reason = "eof"
+    # A sampled call keeps reading after the verdict, only for its timing;
+    # the output and verdict are still the prefix that decided it
+    full_read = read_to_done()
+    timer = CallTimer()
+    stream = _stream_ollama(prompt, model, temperature, max_tokens)
+    try:
+        for data in stream:
+            timer.on_message(data)
+            if "response" in data and verdict is None:
+                full.append(data["response"])
+                verdict = decide_bool("".join(full))
+                if verdict is not None:
+                    stop_reason = "decided"
+                    if not full_read:
+                        break
+            if data.get("done", False) and verdict is None:
+                stop_reason = data.get("done_reason", "stop")
+    finally:
+        stream.close()
+
+    raw = "".join(full).strip()
+    if verdict is None:
+        verdict = normalize_bool(raw)
+    return {"model_output": raw, "model_bool": verdict, "stop_reason": stop_reason,
+            "timing": timer.timing()}
+
+def decide_bool(prefix: str):
+    """
+    Verdict implied by a partial model output, or None if more text is needed.
+    Agrees with normalize_bool on every possible continuation of `prefix`.
+    """
+    stripped = prefix.lstrip()
+    if not stripped:
+        return None
+    word = stripped.split()[0]
+    first = word.lower()
+    if first.startswith("true"):
+        return True
+    word_done = len(stripped) > len(word)
+    if word_done or not "true".startswith(first):
+        return False
+    return None
 
 def normalize_bool(model_raw: str) -> bool:
-    first = model_raw.strip().split()[0]
-    return first.lower().startswith("true")
+    # Empty output (a stream that ended before any token) counts as False
+    words = model_raw.split()
+    return bool(words) and words[0].lower().startswith("true")
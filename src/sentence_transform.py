@@ -2,11 +2,14 @@ import json
 import time
 from pathlib import Path
 import numpy as np
-from sklearn.metrics import precision_recall_fscore_support, accuracy_score
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
+from embedding_store import EmbeddingStore
+from threshold_sweep import sweep_thresholds, best_threshold, roc_auc, pr_auc
 
 SYNTH_PATH = Path("../data/synthetic.jsonl")
+CURVES_PATH = Path("../data/st_curves.npz")
+EMBED_MODEL = "sentence-transformers/multi-qa-mpnet-base-dot-v1"
 
 def load_pairs():
     rows = []
@@ -19,28 +22,6 @@ def embed_texts(model, texts):
     # returns np.array [N, dim]
     return model.encode(texts, convert_to_numpy=True, show_progress_bar=False, normalize_embeddings=True)
 
-def eval_threshold(sims, labels, thresh):
-    preds = sims >= thresh
-    acc = accuracy_score(labels, preds)
-    # For consistency with your report, compute per-class metrics
-    precision, recall, f1, _ = precision_recall_fscore_support(
-        labels,
-        preds,
-        labels=[True, False],
-        zero_division=0
-    )
-    metrics = {
-        "thresh": thresh,
-        "accuracy": acc,
-        "precision_true": precision[0],
-        "recall_true": recall[0],
-        "f1_true": f1[0],
-        "precision_false": precision[1],
-        "recall_false": recall[1],
-        "f1_false": f1[1],
-    }
-    return metrics, preds
-
 def main():
     rows = load_pairs()
     expected_errors = [r["expected_error"] for r in rows]
@@ -49,44 +30,44 @@ def main():
 
     # ---- timing: model load
     t0 = time.time()
-    model = SentenceTransformer("sentence-transformers/multi-qa-mpnet-base-dot-v1")
+    model = SentenceTransformer(EMBED_MODEL)
     t1 = time.time()
     load_secs = t1 - t0
 
-    # ---- timing: encode
+    # ---- timing: encode (only texts the store hasn't seen before)
+    store = EmbeddingStore(EMBED_MODEL)
     t2 = time.time()
-    exp_embs = embed_texts(model, expected_errors)
-    stu_embs = embed_texts(model, student_errors)
+    exp_rows = store.rows_for(expected_errors, lambda texts: embed_texts(model, texts))
+    stu_rows = store.rows_for(student_errors, lambda texts: embed_texts(model, texts))
     t3 = time.time()
     encode_secs = t3 - t2
     encode_per_pair_ms = (encode_secs / len(rows)) * 1000.0
 
-    # cosine similarities
-    sims = (exp_embs * stu_embs).sum(axis=1)  # since we normalized, dot == cosine
+    # cosine similarities, read straight from the memmapped store
+    sims = store.pair_sims(exp_rows, stu_rows)  # since we normalized, dot == cosine
     # alternatively:
     # sims = cosine_similarity(exp_embs, stu_embs).diagonal()
 
-    # sweep thresholds from 0.5 to 0.95
-    all_metrics = []
-    best = None
-    for thresh in np.linspace(0.5, 0.95, 10):
-        metrics, preds = eval_threshold(sims, gold_labels, thresh)
-        all_metrics.append(metrics)
-        if best is None or metrics["accuracy"] > best["accuracy"]:
-            best = {**metrics, "preds": preds}
+    # sweep every distinct similarity value in one sorted pass
+    t4 = time.time()
+    sweep = sweep_thresholds(sims, gold_labels)
+    _, best = best_threshold(sweep, "accuracy")
+    t5 = time.time()
+    np.savez(CURVES_PATH, **sweep)
 
     # confusion matrix for best threshold
-    preds = best["preds"]
-    TP = np.sum((gold_labels == True)  & (preds == True))
-    FN = np.sum((gold_labels == True)  & (preds == False))
-    FP = np.sum((gold_labels == False) & (preds == True))
-    TN = np.sum((gold_labels == False) & (preds == False))
+    preds = sims >= best["thresh"]
+    TP, FN, FP, TN = best["tp"], best["fn"], best["fp"], best["tn"]
 
     print("=== SENTENCE-TRANSFORMER EVAL ===")
-    print(f"Model: all-MiniLM-L6-v2")
+    print(f"Model: {EMBED_MODEL}")
     print(f"Total pairs: {len(rows)}")
     print(f"Best threshold: {best['thresh']:.3f}")
     print(f"Accuracy: {best['accuracy']:.3f}")
+    print(f"Thresholds swept: {len(sweep['thresh'])}")
+    print(f"ROC AUC: {roc_auc(sweep):.3f}")
+    print(f"PR AUC (True class): {pr_auc(sweep):.3f}")
+    print(f"ROC/PR curves saved to {CURVES_PATH}")
     print()
     print("Confusion matrix (gold -> model):")
     print(f"  gold=    1 pred=    1: {TP}")
@@ -108,6 +89,8 @@ def main():
     print(f"Model load time (s): {load_secs:.3f}")
     print(f"Total encode time (s): {encode_secs:.3f}")
     print(f"Avg encode time per pair (ms): {encode_per_pair_ms:.3f}")
+    print(f"Threshold sweep time (ms): {(t5 - t4) * 1000.0:.3f}")
+    print(f"Texts encoded this run: {store.encoded} (store holds {store.count})")
 
     # (optional) print worst disagreements for debugging
     print("\nSome mismatches:\n")
@@ -128,5 +111,14 @@ def main():
         if shown >= 10:
             break
 
+    return {
+        "load_secs": load_secs,
+        "infer_secs": encode_secs,
+        "written": len(rows),
+        "accuracy": best["accuracy"],
+        "f1_true": best["f1_true"],
+        "f1_false": best["f1_false"],
+    }
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,68 @@
+import json
+import threading
+from concurrent.futures import Future
+
+
+def call_key(kind, model, prompt, **options):
+    """Identity of one Ollama request: anything that can change its answer."""
+    return json.dumps([kind, model, prompt, options], sort_keys=True, default=str)
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first
+    caller runs fn, the others block until it finishes and get the same
+    result (or exception). A key is forgotten as soon as its call returns,
+    so only calls that overlap in time are merged; the verdict cache covers
+    repeats that don't.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def do(self, key, fn):
+        """(result, shared): shared is True when another caller's request was reused."""
+        with self._lock:
+            self.calls += 1
+            fut = self._in_flight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._in_flight[key] = Future()
+                self.executed += 1
+                self.peak_in_flight = max(self.peak_in_flight, len(self._in_flight))
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return fut.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "peak_in_flight": self.peak_in_flight,
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        rate = s["coalesced"] / s["calls"] if s["calls"] else 0.0
+        print(f"Coalesced model calls: {s['coalesced']} of {s['calls']} ({rate:.1%}), "
+              f"{s['executed']} sent to Ollama")
@@ -0,0 +1,124 @@
+import itertools
+import time
+
+NS = 1e9
+
+# Per-call timing fields persisted on judged rows
+TIMING_FIELDS = ("queue_sec", "ttft_sec", "load_sec", "prompt_sec", "gen_sec",
+                 "prompt_tokens", "gen_tokens", "tokens_per_sec")
+
+# load_duration above this means Ollama (re)loaded the model for the call
+RELOAD_SECS = 0.5
+
+# Decision-mode calls hang up before Ollama's `done` message, the only source
+# of load/prompt/generation times. The first such call, and one in every
+# FULL_READ_EVERY after it, reads on to `done` anyway (it costs the few
+# tokens left under max_tokens) so the breakdown has server-side figures.
+# 0 turns this off.
+FULL_READ_EVERY = 20
+_decision_calls = itertools.count()
+
+
+def read_to_done():
+    """Whether the next decision-mode call should keep reading to `done` for timing."""
+    return FULL_READ_EVERY > 0 and next(_decision_calls) % FULL_READ_EVERY == 0
+
+
+class CallTimer:
+    """
+    Timing of one streaming /api/generate call. Time to first token and
+    total come from the client clock; load, prompt-processing and
+    generation times come from Ollama's final `done` message. If we hang up
+    before that message (decision mode, except the calls read_to_done picks),
+    generation time falls back to the client clock and the server-side
+    fields stay None.
+
+    Queueing time is not known here: callers measure it (thread pool,
+    limiter, semaphore) and fill in queue_sec.
+    """
+
+    def __init__(self):
+        self.t_send = time.time()
+        self.t_first = None
+        self.chunks = 0
+        self.done = None
+
+    def on_message(self, data):
+        if data.get("response"):
+            if self.t_first is None:
+                self.t_first = time.time()
+            self.chunks += 1
+        if data.get("done", False):
+            self.done = data
+
+    def timing(self):
+        t_end = time.time()
+        timing = {
+            "queue_sec": None,
+            "ttft_sec": self.t_first - self.t_send if self.t_first is not None else None,
+            "total_sec": t_end - self.t_send,
+            "load_sec": None,
+            "prompt_sec": None,
+            "gen_sec": None,
+            "prompt_tokens": None,
+            "gen_tokens": self.chunks,
+            "tokens_per_sec": None,
+        }
+        d = self.done
+        if d is not None:
+            timing["load_sec"] = d.get("load_duration", 0) / NS
+            timing["prompt_sec"] = d.get("prompt_eval_duration", 0) / NS
+            # Ollama leaves prompt_eval_count out when the prompt was already cached
+            timing["prompt_tokens"] = d.get("prompt_eval_count", 0)
+            timing["gen_sec"] = d.get("eval_duration", 0) / NS
+            timing["gen_tokens"] = d.get("eval_count", self.chunks)
+            if timing["gen_sec"] and timing["gen_tokens"]:
+                timing["tokens_per_sec"] = timing["gen_tokens"] / timing["gen_sec"]
+        elif self.t_first is not None:
+            timing["gen_sec"] = t_end - self.t_first
+            # Rate between first and last token seen; one token says nothing
+            if self.chunks > 1 and timing["gen_sec"] > 0:
+                timing["tokens_per_sec"] = (self.chunks - 1) / timing["gen_sec"]
+        return timing
+
+
+def row_fields(timing):
+    """The persisted subset of a timing dict, for merging into a judged row."""
+    return {k: timing.get(k) for k in TIMING_FIELDS}
+
+
+def _pct(sorted_vals, q):
+    return sorted_vals[min(int(len(sorted_vals) * q), len(sorted_vals) - 1)]
+
+
+def print_timing_breakdown(timings):
+    """
+    Aggregate per-call timing, from timing dicts or judged rows carrying
+    the timing fields (cache hits excluded by the caller).
+    """
+    timings = [t for t in timings if t]
+    if not timings:
+        return
+    print(f"=== CALL TIMING BREAKDOWN ({len(timings)} model calls) ===")
+    print(f"{'field':<15} {'n':>6} {'mean':>10} {'p50':>10} {'p95':>10}")
+    means = {}
+    for field in TIMING_FIELDS:
+        vals = sorted(t[field] for t in timings if t.get(field) is not None)
+        if not vals:
+            continue
+        means[field] = sum(vals) / len(vals)
+        print(f"{field:<15} {len(vals):>6} {means[field]:>10.4f} "
+              f"{_pct(vals, 0.50):>10.4f} {_pct(vals, 0.95):>10.4f}")
+
+    # Where the wall time of an average call goes
+    parts = {k: means.get(f"{k}_sec", 0.0) for k in ("queue", "load", "prompt", "gen")}
+    # Timing dicts carry total_sec; judged rows carry the same thing as latency_sec
+    wall = parts["queue"] + sum(t.get("total_sec", t.get("latency_sec", 0.0))
+                                for t in timings) / len(timings)
+    parts["other"] = max(wall - sum(parts.values()), 0.0)
+    if wall > 0:
+        print("Share of call time: " + ", ".join(
+            f"{k} {v / wall:.0%}" for k, v in parts.items()))
+    reloads = sum(1 for t in timings if (t.get("load_sec") or 0) > RELOAD_SECS)
+    if reloads:
+        print(f"Calls that paid a model load (> {RELOAD_SECS}s): {reloads}")
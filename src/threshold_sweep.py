@@ -0,0 +1,70 @@
+import numpy as np
+
+
+def _safe_div(num, den):
+    return np.divide(num, den, out=np.zeros(len(num), dtype=np.float64), where=den > 0)
+
+
+def sweep_thresholds(sims, labels):
+    """
+    Metrics for "predict True iff sim >= t" at every distinct similarity t,
+    from one descending sort and cumulative counts (O(n log n) overall).
+
+    Returns a dict of equal-length arrays ordered by decreasing threshold.
+    The first entry is t = +inf (nothing predicted True), so the ROC curve
+    starts at (0, 0).
+    """
+    sims = np.asarray(sims, dtype=np.float64)
+    labels = np.asarray(labels, dtype=bool)
+
+    order = np.argsort(-sims, kind="stable")
+    s = sims[order]
+    y = labels[order]
+
+    # Last position of each run of equal similarity values
+    ends = np.flatnonzero(np.r_[s[1:] != s[:-1], True])
+
+    tp = np.r_[0, np.cumsum(y)[ends]]
+    fp = np.r_[0, ends + 1 - tp[1:]]
+    pos = int(y.sum())
+    neg = len(y) - pos
+    fn = pos - tp
+    tn = neg - fp
+    n = max(len(y), 1)
+
+    precision_true = _safe_div(tp, tp + fp)
+    recall_true = _safe_div(tp, np.full(len(tp), pos))
+    precision_false = _safe_div(tn, tn + fn)
+    recall_false = _safe_div(tn, np.full(len(tn), neg))
+
+    return {
+        "thresh": np.r_[np.inf, s[ends]],
+        "tp": tp, "fp": fp, "tn": tn, "fn": fn,
+        "accuracy": (tp + tn) / n,
+        "precision_true": precision_true,
+        "recall_true": recall_true,
+        "f1_true": _safe_div(2 * precision_true * recall_true, precision_true + recall_true),
+        "precision_false": precision_false,
+        "recall_false": recall_false,
+        "f1_false": _safe_div(2 * precision_false * recall_false, precision_false + recall_false),
+        # ROC: x = false positive rate, y = true positive rate
+        "fpr": _safe_div(fp, np.full(len(fp), neg)),
+        "tpr": recall_true,
+    }
+
+
+def best_threshold(sweep, metric="accuracy"):
+    """Index and scalar metrics of the threshold that maximizes `metric`."""
+    i = int(np.argmax(sweep[metric]))
+    return i, {k: v[i].item() for k, v in sweep.items()}
+
+
+def roc_auc(sweep):
+    return float(np.trapezoid(sweep["tpr"], sweep["fpr"]))
+
+
+def pr_auc(sweep):
+    # Step-wise average precision, skipping the empty t = +inf point
+    recall = sweep["recall_true"]
+    precision = sweep["precision_true"]
+    return float(np.sum(np.diff(recall) * precision[1:]))